@@ -4,8 +4,12 @@ from .core.environment import ExecutionEnvironment
 from .core.status import Status
 from .core.utilities import Utilities
 from .core.report import BugReport
-from .enums import (ConnectionMetadataEnum, ConnectionTypeEnum, FeatureEnum,
-                    MetadataEnum)
+from .core.servers.physical import (FAILED_SERVER_TTL, PhysicalServerSelector,
+                                    host_key)
+from .enums import (ConnectionMetadataEnum, ConnectionStartStatusEnum,
+                    ConnectionTypeEnum, FeatureEnum,
+                    LastConnectionMetadataEnum, MetadataEnum,
+                    VPNConnectionStateEnum)
 from .logger import logger
 
 
@@ -46,6 +50,19 @@ class ProtonVPNClientAPI:
         """
         self._utils.ensure_internet_connection_is_available()
         connect_result = self._env.connection_backend.connect()
+        if (
+            connect_result.get(ConnectionStartStatusEnum.STATE)
+            != VPNConnectionStateEnum.IS_ACTIVE
+        ):
+            # Leave the server out of the next selections for a while
+            try:
+                server_ip = self._env.connection_metadata.get_server_ip()
+            except KeyError:
+                pass
+            else:
+                self._env.connection_metadata.save_failed_server_ip(
+                    server_ip, FAILED_SERVER_TTL
+                )
         self._env.connection_metadata.save_connect_time()
         return connect_result
 
@@ -113,7 +130,9 @@ class ProtonVPNClientAPI:
         server = connect_configurations[connection_type](
             _connection_type_extra_arg,
         )
-        physical_server = server.get_random_physical_server()
+        physical_server = server.get_physical_server(
+            self.__physical_server_selector(server)
+        )
         self._env.api_session.servers.match_server_domain(physical_server)
 
         openvpn_username = self._env.api_session.vpn_username
@@ -146,6 +165,40 @@ class ProtonVPNClientAPI:
         self._env.connection_backend.setup(**data)
         return server
 
+    def __physical_server_selector(self, server):
+        """Get the selector of the physical server to connect to.
+
+        The same user on the same host keeps getting the same physical
+        server of a logical server, and reconnecting to the previous
+        server goes to the same entry IP, unless it recently failed.
+
+        Args:
+            server (LogicalServer): server to connect to
+
+        Returns:
+            PhysicalServerSelector
+        """
+        last_connection_metadata = self._env.connection_metadata\
+            .get_connection_metadata(
+                MetadataEnum.LAST_CONNECTION
+            )
+        preferred_entry_ip = None
+        if last_connection_metadata.get(
+            ConnectionMetadataEnum.SERVER.value
+        ) == server.name:
+            preferred_entry_ip = last_connection_metadata.get(
+                LastConnectionMetadataEnum.SERVER_IP.value
+            )
+
+        return PhysicalServerSelector(
+            key="{}|{}".format(
+                self._env.api_session.vpn_username, host_key()
+            ),
+            preferred_entry_ip=preferred_entry_ip,
+            failed_entry_ips=self._env.connection_metadata
+            .get_failed_server_ips(FAILED_SERVER_TTL)
+        )
+
     def config_for_fastest_server(self, *_):
         """Select fastest server.
 
@@ -155,16 +208,8 @@ class ProtonVPNClientAPI:
         secure_core = bool(self._env.settings.secure_core.value)
         logger.info("Fastest with secure core \"{}\"".format(secure_core))
         try:
-            return self._env.api_session.servers.filter(
-                lambda server:
-                    (
-                        secure_core
-                        and FeatureEnum.SECURE_CORE in server.features
-                    ) or (
-                        not secure_core
-                        and FeatureEnum.SECURE_CORE not in server.features
-                        and FeatureEnum.TOR not in server.features
-                    )
+            return self._env.api_session.servers.where(
+                **self._get_secure_core_criteria(secure_core)
             ).get_fastest_server()
         except exceptions.EmptyServerListError:
             raise exceptions.FastestServerNotFound(
@@ -180,19 +225,9 @@ class ProtonVPNClientAPI:
         secure_core = bool(self._env.settings.secure_core.value)
         logger.info("Country with secure core \"{}\"".format(secure_core))
         try:
-            return self._env.api_session.servers.filter(
-                lambda server:
-                server.exit_country.lower() == country_code.lower()
-                and (
-                    (
-                        secure_core
-                        and FeatureEnum.SECURE_CORE in server.features
-                    ) or (
-                        not secure_core
-                        and FeatureEnum.SECURE_CORE not in server.features
-                        and FeatureEnum.TOR not in server.features
-                    )
-                )
+            return self._env.api_session.servers.where(
+                exit_country=country_code,
+                **self._get_secure_core_criteria(secure_core)
             ).get_fastest_server()
         except exceptions.EmptyServerListError:
             raise exceptions.FastestServerInCountryNotFound(
@@ -221,15 +256,8 @@ class ProtonVPNClientAPI:
             if f in connection_type_translation
         ]
         try:
-            return self._env.api_session.servers.filter(
-                lambda server: (
-                    all(
-                        chosen_feature
-                        in server.features
-                        for chosen_feature
-                        in possible_features
-                    )
-                )
+            return self._env.api_session.servers.where(
+                features=possible_features
             ).get_fastest_server()
         except exceptions.EmptyServerListError:
             raise exceptions.FeatureServerNotFound(
@@ -238,6 +266,20 @@ class ProtonVPNClientAPI:
                 "you don't have access to the server with your plan."
             )
 
+    def _get_secure_core_criteria(self, secure_core):
+        """Get the ServerQuery criteria for secure core.
+
+        Returns:
+            dict
+        """
+        if secure_core:
+            return {"secure_core": True}
+
+        return {
+            "secure_core": False,
+            "exclude_features": [FeatureEnum.TOR]
+        }
+
     def config_for_server_with_servername(self, servername):
         """Select server by servername.
 
@@ -245,8 +287,8 @@ class ProtonVPNClientAPI:
             LogicalServer
         """
         try:
-            return self._env.api_session.servers.filter(
-                lambda server: server.name.lower() == servername.lower() # noqa
+            return self._env.api_session.servers.where(
+                name=servername
             ).get_fastest_server()
         except exceptions.EmptyServerListError:
             raise exceptions.ServernameServerNotFound(
@@ -262,7 +304,10 @@ class ProtonVPNClientAPI:
             LogicalServer
         """
         try:
-            return self._env.api_session.servers.get_random_server()
+            # Prefer less loaded servers
+            return self._env.api_session.servers.get_random_server(
+                weighted=True
+            )
         except exceptions.EmptyServerListError:
             raise exceptions.RandomServerNotFound(
                 "Random server could not be found."
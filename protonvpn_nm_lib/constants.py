@@ -101,6 +101,12 @@ LOCAL_SERVICE_FILEPATH = os.path.join(
 CACHED_SERVERLIST = os.path.join(
     PROTON_XDG_CACHE_HOME, "cached_serverlist.json"
 )
+CACHED_SERVERLIST_SNAPSHOT = os.path.join(
+    PROTON_XDG_CACHE_HOME, "cached_serverlist.bin"
+)
+CACHED_SERVERLIST_JOURNAL = os.path.join(
+    PROTON_XDG_CACHE_HOME, "cached_serverlist.journal"
+)
 CACHED_OPENVPN_CERTIFICATE = os.path.join(
     PROTON_XDG_CACHE_HOME, "ProtonVPN.ovpn"
 )
@@ -122,6 +128,12 @@ STREAMING_SERVICES = os.path.join(
 STREAMING_ICONS_CACHE_TIME_PATH = os.path.join(
     PROTON_XDG_CACHE_HOME, "streaming_icons_cache.json"
 )
+CACHE_VALIDATORS = os.path.join(
+    PROTON_XDG_CACHE_HOME, "cache_validators.json"
+)
+CACHE_LOCK = os.path.join(
+    PROTON_XDG_CACHE_HOME, "cache.lock"
+)
 API_METADATA_FILEPATH = os.path.join(
     PROTON_XDG_CACHE_HOME, "api_metadata.json"
 )
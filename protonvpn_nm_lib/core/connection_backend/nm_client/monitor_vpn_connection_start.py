@@ -64,10 +64,11 @@ class MonitorVPNConnectionStart:
             self.dbus_response[ConnectionStartStatusEnum.MESSAGE] = msg
             self.dbus_response[ConnectionStartStatusEnum.REASON] = reason
 
+            # Don't hold the loop while caches are refreshed
             try:
-                env.api_session.update_servers_if_needed()
+                env.api_session.refresh_in_background()
             except: # noqa
-                # Just skip if servers could not be updated
+                # Just skip if caches could not be updated
                 pass
             logger.info("Quitting loop on active ProtonVPN connection")
             self.loop.quit()
@@ -28,6 +28,16 @@ class Country:
             dict: country_code: [servername]
                 ie {PT: [PT#5, PT#8]}
         """
+        if hasattr(server_list, "countries"):
+            # ServerList keeps the names per country, for each version
+            servernames = server_list.countries.servernames(
+                None if user_tier is False else int(user_tier)
+            )
+            return {
+                self.get_country_name(country_code): names
+                for country_code, names in servernames.items()
+            }
+
         countries = {}
         for server in server_list:
             if user_tier is not False and int(server.tier) <= int(user_tier):
@@ -52,6 +62,9 @@ class Country:
             dict: country_code: [servername]
                 ie {PT: [PT#5, PT#8]}
         """
+        if hasattr(server_list, "countries"):
+            return server_list.countries.servernames()
+
         countries = {}
         for server in server_list:
             if countries.get(server.exit_country):
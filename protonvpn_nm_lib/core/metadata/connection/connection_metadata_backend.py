@@ -46,6 +46,16 @@ class ConnectionMetadataBackend(SubclassesMixin, metaclass=ABCMeta):
         """Get server IP to which connection is made."""
         pass
 
+    @abstractmethod
+    def save_failed_server_ip():
+        """Save server IP to which connection failed."""
+        pass
+
+    @abstractmethod
+    def get_failed_server_ips():
+        """Get server IPs to which connection recently failed."""
+        pass
+
     @abstractmethod
     def get_connection_metadata():
         """Get state metadata."""
@@ -138,6 +138,54 @@ class ConnectionMetadata(ConnectionMetadataBackend):
             MetadataEnum.LAST_CONNECTION
         )[LastConnectionMetadataEnum.SERVER_IP.value]
 
+    def save_failed_server_ip(self, ip, max_age):
+        """Save server IP to which connection failed.
+
+        Failures older than max_age are dropped.
+
+        Args:
+            IP (string): server IP
+            max_age (int): seconds after which a failure is forgotten
+        """
+        last_metadata = self.get_connection_metadata(
+            MetadataEnum.LAST_CONNECTION
+        )
+        now = time.time()
+        failed_ips = {
+            failed_ip: failed_at
+            for failed_ip, failed_at in last_metadata.get(
+                LastConnectionMetadataEnum.FAILED_SERVER_IPS.value, {}
+            ).items()
+            if now - failed_at < max_age
+        }
+        failed_ips[ip] = now
+        last_metadata[
+            LastConnectionMetadataEnum.FAILED_SERVER_IPS.value
+        ] = failed_ips
+        logger.info("Saving failed server ip \"{}\" on \"{}\"".format(
+            ip, MetadataEnum.LAST_CONNECTION
+        ))
+        self.__write_connection_metadata(
+            MetadataEnum.LAST_CONNECTION, last_metadata
+        )
+
+    def get_failed_server_ips(self, max_age):
+        """Get server IPs to which connection recently failed.
+
+        Args:
+            max_age (int): seconds after which a failure is forgotten
+        Returns:
+            list: server IPs
+        """
+        failed_ips = self.get_connection_metadata(
+            MetadataEnum.LAST_CONNECTION
+        ).get(LastConnectionMetadataEnum.FAILED_SERVER_IPS.value, {})
+        now = time.time()
+        return [
+            ip for ip, failed_at in failed_ips.items()
+            if now - failed_at < max_age
+        ]
+
     def get_connection_metadata(self, metadata_type):
         """Get connection state metadata.
 
@@ -1,3 +1,6 @@
+from .changes import ServerListChanges
 from .list import ServerList
+from .query import ServerQuery
+from .snapshot import ServerListSnapshot
 
-__all__ = ['ServerList']
+__all__ = ['ServerList', 'ServerListChanges', 'ServerQuery', 'ServerListSnapshot']
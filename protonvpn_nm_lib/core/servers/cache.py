@@ -0,0 +1,50 @@
+import collections
+import threading
+
+CacheInfo = collections.namedtuple(
+    "CacheInfo", ["hits", "misses", "maxsize", "currsize"]
+)
+
+
+class LRUCache:
+    """
+    Bounded mapping dropping the least recently used entries first.
+
+    Keys are expected to include whatever version they depend on, the
+    cache itself never expires entries. It is safe to use from several
+    threads.
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__entries = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.__lock:
+            try:
+                value = self.__entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.__lock:
+            self.__entries[key] = value
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.maxsize:
+                self.__entries.popitem(last=False)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+    def info(self):
+        return CacheInfo(
+            self.hits, self.misses, self.maxsize, len(self.__entries)
+        )
@@ -0,0 +1,148 @@
+class ServerListChanges:
+    """
+    What changed in a ServerList from one version to the next.
+
+    Servers are identified by their logical IDs:
+    - added, removed: servers that appeared or disappeared
+    - enabled, disabled: servers whose enabled state changed
+    - loads, scores: {ID: (previous, new)} for the servers whose load or
+        score changed by at least the thresholds of compute_changes()
+
+    When the logicals were replaced, the changes are only computed the
+    first time they are accessed, so that loading a list does not
+    depend on its size unless someone is interested in the changes.
+    """
+    FIELDS = ("added", "removed", "enabled", "disabled", "loads", "scores")
+
+    def __init__(self, previous_version, version, compute=None):
+        self.previous_version = previous_version
+        self.version = version
+        self.__compute = compute
+        self.__values = None
+
+    def _values(self):
+        if self.__values is None:
+            values = {
+                "added": [], "removed": [], "enabled": [], "disabled": [],
+                "loads": {}, "scores": {},
+            }
+            if self.__compute is not None:
+                self.__compute(values)
+                self.__compute = None
+            self.__values = values
+
+        return self.__values
+
+    @property
+    def added(self):
+        return self._values()["added"]
+
+    @property
+    def removed(self):
+        return self._values()["removed"]
+
+    @property
+    def enabled(self):
+        return self._values()["enabled"]
+
+    @property
+    def disabled(self):
+        return self._values()["disabled"]
+
+    @property
+    def loads(self):
+        return self._values()["loads"]
+
+    @property
+    def scores(self):
+        return self._values()["scores"]
+
+    def __bool__(self):
+        return any(self._values()[field] for field in self.FIELDS)
+
+    def __repr__(self):
+        return (
+            "ServerListChanges<{}->{}: +{} -{} enabled:{} disabled:{} "
+            "loads:{} scores:{}>".format(
+                self.previous_version, self.version,
+                len(self.added), len(self.removed),
+                len(self.enabled), len(self.disabled),
+                len(self.loads), len(self.scores)
+            )
+        )
+
+
+def compute_changes(
+    previous, current, previous_version, version, rows=None,
+    load_threshold=0, score_threshold=0.
+):
+    """
+    Compare two ServerColumns.
+
+    Args:
+        previous (ServerColumns), current (ServerColumns)
+        previous_version (int), version (int)
+        rows (iterable): if the logicals didn't change (ie load updates),
+            the only rows to compare. Otherwise servers are matched by ID,
+            once the changes are accessed.
+        load_threshold (int), score_threshold (float): minimal absolute
+            differences to report a load or score change
+    Returns:
+        ServerListChanges
+    """
+    def compute(values):
+        _compare(
+            values, previous, current, rows, load_threshold, score_threshold
+        )
+
+    changes = ServerListChanges(previous_version, version, compute)
+    if rows is not None:
+        # Only a few rows to compare, and the columns don't need
+        # to be kept
+        changes._values()
+
+    return changes
+
+
+def _compare(values, previous, current, rows, load_threshold, score_threshold):
+    if rows is not None:
+        pairs = ((row, row) for row in rows)
+    else:
+        previous_rows = {
+            logical_id: row for row, logical_id in enumerate(previous.id)
+        }
+        current_rows = {
+            logical_id: row for row, logical_id in enumerate(current.id)
+        }
+        values["added"] = [
+            logical_id for logical_id in current_rows
+            if logical_id not in previous_rows
+        ]
+        values["removed"] = [
+            logical_id for logical_id in previous_rows
+            if logical_id not in current_rows
+        ]
+        pairs = (
+            (previous_rows[logical_id], row)
+            for logical_id, row in current_rows.items()
+            if logical_id in previous_rows
+        )
+
+    for previous_row, row in pairs:
+        logical_id = current.id[row]
+        if previous.enabled[previous_row] != current.enabled[row]:
+            if current.enabled[row]:
+                values["enabled"].append(logical_id)
+            else:
+                values["disabled"].append(logical_id)
+
+        loads = (previous.load[previous_row], current.load[row])
+        if loads[0] != loads[1] and abs(loads[1] - loads[0]) >= load_threshold:
+            values["loads"][logical_id] = loads
+
+        scores = (previous.score[previous_row], current.score[row])
+        if (
+            scores[0] != scores[1]
+            and abs(scores[1] - scores[0]) >= score_threshold
+        ):
+            values["scores"][logical_id] = scores
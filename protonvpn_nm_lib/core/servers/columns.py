@@ -0,0 +1,326 @@
+import array
+import bisect
+import heapq
+import itertools
+import random
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class StringColumn:
+    """
+    Column of (mostly repeated) strings.
+
+    Every distinct value is stored once in `values`, and each row
+    only holds the index of its value in `codes`.
+    """
+    def __init__(self):
+        self.codes = array.array("H")
+        self.values = []
+        self._lookup = {}
+
+    def append(self, value):
+        code = self._lookup.get(value)
+        if code is None:
+            code = len(self.values)
+            self._lookup[value] = code
+            self.values.append(value)
+
+        self.codes.append(code)
+
+    def code_of(self, value):
+        return self._lookup.get(value)
+
+    def __getitem__(self, row):
+        return self.values[self.codes[row]]
+
+    def __len__(self):
+        return len(self.codes)
+
+    @classmethod
+    def from_buffers(cls, codes, values):
+        column = cls()
+        column.codes = codes
+        column.values = list(values)
+        column._lookup = {value: code for code, value in enumerate(column.values)}
+        return column
+
+
+class RowSampler:
+    """
+    Draw rows at random, uniformly in O(1) or proportionally to
+    their weights in O(log n).
+    """
+    def __init__(self, rows, weights=None):
+        self.rows = rows
+        self._cumulative_weights = None
+        if weights is not None:
+            self._cumulative_weights = list(itertools.accumulate(weights))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def draw(self, rng=random):
+        if len(self.rows) == 0:
+            raise IndexError("Cannot draw from an empty sampler")
+
+        if self._cumulative_weights is None:
+            return self.rows[rng.randrange(len(self.rows))]
+
+        idx = bisect.bisect_right(
+            self._cumulative_weights,
+            rng.random() * self._cumulative_weights[-1]
+        )
+        return self.rows[min(idx, len(self.rows) - 1)]
+
+
+class ServerColumns:
+    """
+    Columnar copy of the logical server fields used to filter and sort.
+
+    Row `i` holds the values of the i-th entry in the toplevel
+    `LogicalServers`, so the row numbers are the same as the ones
+    stored in ServerList._ids.
+
+    Numeric columns are kept in typed arrays (or memoryviews, for
+    columns of a ServerListSnapshot). If NumPy is available, filters and
+    sorts run on array views of these buffers, otherwise they fall back
+    to plain Python passes over the arrays.
+
+    IDs and names are kept as plain sequences of strings.
+
+    Rows are expected to be grouped by tier, in increasing order (see
+    ServerList), so that the rows of each tier (tier_partitions) are a
+    contiguous range.
+    """
+    NUMERIC_COLUMNS = {
+        "load": "B",
+        "score": "d",
+        "tier": "B",
+        "status": "B",
+        # Whether any physical server is enabled
+        "servers_enabled": "B",
+        "enabled": "B",
+        "features": "I",
+    }
+    # Columns modified by update_loads()
+    MUTABLE_COLUMNS = ("load", "score", "status", "enabled")
+
+    def __init__(self, logicals=()):
+        for name, typecode in self.NUMERIC_COLUMNS.items():
+            setattr(self, name, array.array(typecode))
+
+        self.exit_country = StringColumn()
+        self.entry_country = StringColumn()
+        self.city = StringColumn()
+        self.region = StringColumn()
+        self.id = []
+        self.name = []
+
+        for logical in logicals:
+            self.append(logical)
+
+        self._vectors = {}
+        self._partitions = None
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Create columns backed by the buffers of a ServerListSnapshot."""
+        columns = cls.__new__(cls)
+        for name, typecode in cls.NUMERIC_COLUMNS.items():
+            setattr(columns, name, snapshot.column(name, typecode))
+
+        for name in ["exit_country", "entry_country", "city", "region"]:
+            setattr(columns, name, StringColumn.from_buffers(
+                snapshot.column(name, "H"),
+                [
+                    value if value != "" else None
+                    for value in snapshot.strings(name + ".values")
+                ]
+            ))
+
+        columns.id = snapshot.ids
+        columns.name = snapshot.names
+        columns._vectors = {}
+        columns._partitions = snapshot.tier_partitions()
+        return columns
+
+    def copy(self):
+        """
+        Copy the columns, to update loads without modifying these ones.
+
+        Only the columns changed by update_loads() are copied, the
+        others are shared.
+        """
+        columns = self.__class__.__new__(self.__class__)
+        columns.__dict__.update(self.__dict__)
+        for name in self.MUTABLE_COLUMNS:
+            column = getattr(self, name)
+            typecode = getattr(column, "typecode", None) or column.format
+            setattr(columns, name, array.array(typecode, column))
+
+        columns._vectors = {
+            name: vector for name, vector in self._vectors.items()
+            if name not in self.MUTABLE_COLUMNS
+        }
+        return columns
+
+    def append(self, logical):
+        servers_enabled = any(
+            physical["Status"] == 1 for physical in logical["Servers"]
+        )
+        self.load.append(int(logical["Load"]))
+        self.score.append(float(logical["Score"]))
+        self.tier.append(int(logical["Tier"]))
+        self.status.append(int(logical["Status"]))
+        self.servers_enabled.append(servers_enabled)
+        self.enabled.append(logical["Status"] == 1 and servers_enabled)
+        self.features.append(int(logical["Features"]))
+        self.exit_country.append(logical["ExitCountry"])
+        self.entry_country.append(logical["EntryCountry"])
+        self.city.append(logical["City"])
+        self.region.append(logical["Region"])
+        self.id.append(logical["ID"])
+        self.name.append(logical["Name"])
+
+    def update_loads(self, row, load, score, status):
+        """Update the mutable columns (load, score, status) of a row."""
+        self.load[row] = int(load)
+        self.score[row] = float(score)
+        self.status[row] = int(status)
+        self.enabled[row] = status == 1 and self.servers_enabled[row]
+
+    def __len__(self):
+        return len(self.load)
+
+    def tier_partitions(self):
+        """Return {tier: range of the rows of that tier}."""
+        if self._partitions is None:
+            partitions = {}
+            start = 0
+            while start < len(self.tier):
+                tier = self.tier[start]
+                end = bisect.bisect_right(self.tier, tier, start)
+                partitions[tier] = range(start, end)
+                start = end
+            self._partitions = partitions
+
+        return self._partitions
+
+    def rows_up_to_tier(self, max_tier):
+        """Return the range of the rows with a tier <= max_tier."""
+        end = 0
+        for tier, rows in self.tier_partitions().items():
+            if tier <= max_tier:
+                end = max(end, rows.stop)
+
+        return range(end)
+
+    def _vector(self, name):
+        # NumPy views share the memory of the arrays, so in place updates
+        # (update_loads) are seen by them. Arrays are never resized once
+        # the columns are built, which is required while a view exists.
+        vector = self._vectors.get(name)
+        if vector is None:
+            column = getattr(self, name)
+            typecode = getattr(column, "typecode", None) or column.format
+            vector = numpy.frombuffer(column, dtype=typecode)
+            self._vectors[name] = vector
+
+        return vector
+
+    def select(self, rows, max_tier=None, enabled=False, exclude_features=0):
+        """
+        Return the rows (in the given order) matching the criteria.
+
+        exclude_features is a bitmask of FeatureEnum, rows having
+        any of these features are left out.
+        """
+        if max_tier is not None and isinstance(rows, range) and rows.step == 1:
+            # The rows of the tiers above max_tier are never looked at
+            rows = range(
+                rows.start,
+                min(rows.stop, self.rows_up_to_tier(max_tier).stop)
+            )
+            max_tier = None
+
+        if max_tier is None and not enabled and not exclude_features:
+            return list(rows)
+
+        if numpy is not None and len(rows) > 0:
+            rows = numpy.asarray(rows, dtype=numpy.intp)
+            mask = numpy.ones(len(rows), dtype=bool)
+            if max_tier is not None:
+                mask &= self._vector("tier")[rows] <= max_tier
+            if enabled:
+                mask &= self._vector("enabled")[rows] != 0
+            if exclude_features:
+                mask &= (self._vector("features")[rows] & exclude_features) == 0
+            return rows[mask].tolist()
+
+        tier = self.tier
+        is_enabled = self.enabled
+        features = self.features
+        return [
+            row for row in rows
+            if (max_tier is None or tier[row] <= max_tier)
+            and (not enabled or is_enabled[row])
+            and not features[row] & exclude_features
+        ]
+
+    def sampler(self, rows, max_tier=None, enabled=False, weighted=False):
+        """
+        Return a RowSampler over the rows matching the criteria.
+
+        If weighted, the probability of a row is proportional to
+        1 / (1 + load), so that loaded servers are less likely drawn.
+        """
+        rows = self.select(rows, max_tier=max_tier, enabled=enabled)
+        if not weighted:
+            return RowSampler(rows)
+
+        load = self.load
+        return RowSampler(rows, [1.0 / (1 + load[row]) for row in rows])
+
+    def smallest(self, rows, column, k, reverse=False):
+        """
+        Return the k rows with the smallest values in column (largest
+        if reverse), sorted, without sorting all of the rows.
+
+        Equal values keep the order of rows, so the result is the same
+        as the first k elements of sort_rows().
+        """
+        if k <= 0 or len(rows) == 0:
+            return []
+
+        if numpy is not None:
+            rows = numpy.asarray(rows, dtype=numpy.intp)
+            values = self._vector(column)[rows].astype(numpy.float64)
+            if reverse:
+                values = -values
+            if k < len(rows):
+                # Keep every row up to the k-th value (ties included),
+                # in their original order, before the final stable sort
+                kth_value = numpy.partition(values, k - 1)[k - 1]
+                candidates = numpy.flatnonzero(values <= kth_value)
+                rows, values = rows[candidates], values[candidates]
+            return rows[numpy.argsort(values, kind="stable")[:k]].tolist()
+
+        select = heapq.nlargest if reverse else heapq.nsmallest
+        return select(k, rows, key=getattr(self, column).__getitem__)
+
+    def sort_rows(self, rows, column, reverse=False):
+        """Return rows sorted (stable) on the values of column."""
+        if numpy is not None and len(rows) > 0:
+            rows = numpy.asarray(rows, dtype=numpy.intp)
+            values = self._vector(column)[rows].astype(numpy.float64)
+            if reverse:
+                # Negate instead of flipping the result, so that equal
+                # values keep their order like sorted(reverse=True) does
+                values = -values
+            return rows[numpy.argsort(values, kind="stable")].tolist()
+
+        return sorted(rows, key=getattr(self, column).__getitem__, reverse=reverse)
@@ -0,0 +1,126 @@
+from ...enums import FeatureEnum
+
+
+class CountryNode:
+    """
+    Servers of an exit country, grouped by city, with aggregates.
+
+    Attributes:
+        code (str): exit country code
+        cities (dict): {city: [servername]}, city being None for the
+            servers without one
+        rows (tuple): toplevel rows of the servers of the country
+        names (tuple): names of the servers, in the order of rows
+        server_count (int), enabled_count (int)
+        min_load (int), avg_load (float): over enabled servers, None
+            when no server is enabled
+        features (list): FeatureEnum available in at least one server
+        max_tier (int): highest tier of the servers
+    """
+    def __init__(self, code, rows, columns):
+        self.code = code
+        self.rows = tuple(rows)
+        self.names = tuple(columns.name[row] for row in self.rows)
+        self.cities = {}
+        features = 0
+        for row, name in zip(self.rows, self.names):
+            self.cities.setdefault(columns.city[row], []).append(name)
+            features |= columns.features[row]
+
+        self.server_count = len(self.rows)
+        self.features = [
+            feature for feature in FeatureEnum.list()
+            if feature != FeatureEnum.NORMAL and features & feature
+        ]
+        self.max_tier = max(columns.tier[row] for row in self.rows)
+        self.__aggregate_loads(columns)
+
+    def __aggregate_loads(self, columns):
+        loads = [columns.load[row] for row in self.rows if columns.enabled[row]]
+        self.enabled_count = len(loads)
+        self.min_load = min(loads) if loads else None
+        self.avg_load = sum(loads) / len(loads) if loads else None
+
+    def with_loads(self, columns):
+        """Copy of the node, with the loads of columns."""
+        node = self.__class__.__new__(self.__class__)
+        node.__dict__.update(self.__dict__)
+        node.__aggregate_loads(columns)
+        return node
+
+    def __repr__(self):
+        return "CountryNode<{}: {}/{} servers>".format(
+            self.code, self.enabled_count, self.server_count
+        )
+
+
+class CountryTree:
+    """
+    Exit countries of a server list (country -> city -> servers).
+
+    Country and city groupings only depend on the logicals, so when
+    loads change, only the aggregates of the countries having changed
+    servers are computed again (with_loads).
+    """
+    def __init__(self, columns, rows=None):
+        if rows is None:
+            rows = range(len(columns))
+
+        rows_by_country = {}
+        for row in rows:
+            rows_by_country.setdefault(columns.exit_country[row], []).append(row)
+
+        self._tiers = columns.tier
+        self.countries = {
+            code: CountryNode(code, country_rows, columns)
+            for code, country_rows in rows_by_country.items()
+        }
+        self.__servernames = {}
+
+    def with_loads(self, columns, rows):
+        """Copy of the tree, with the loads of the given rows updated."""
+        codes = {columns.exit_country[row] for row in rows}
+        tree = self.__class__.__new__(self.__class__)
+        tree._tiers = self._tiers
+        tree.countries = dict(self.countries)
+        for code in codes:
+            if code in tree.countries:
+                tree.countries[code] = tree.countries[code].with_loads(columns)
+
+        # Names and tiers don't depend on loads
+        tree.__servernames = self.__servernames
+        return tree
+
+    def servernames(self, max_tier=None):
+        """
+        Get the server names per country, ie {PT: [PT#5, PT#8]}.
+
+        Servers above max_tier are left out, countries without any
+        server are too. The result is cached per max_tier, and copied.
+        """
+        servernames = self.__servernames.get(max_tier)
+        if servernames is None:
+            servernames = {}
+            for code, node in self.countries.items():
+                names = [
+                    name
+                    for row, name in zip(node.rows, node.names)
+                    if max_tier is None or self._tiers[row] <= max_tier
+                ]
+                if names:
+                    servernames[code] = names
+            self.__servernames[max_tier] = servernames
+
+        return {code: list(names) for code, names in servernames.items()}
+
+    def __getitem__(self, code):
+        return self.countries[code]
+
+    def __contains__(self, code):
+        return code in self.countries
+
+    def __iter__(self):
+        return iter(self.countries.values())
+
+    def __len__(self):
+        return len(self.countries)
@@ -0,0 +1,209 @@
+import bisect
+
+from ...enums import FeatureEnum
+from .search import ServerSearchIndex
+
+
+class ServerIndexes:
+    """
+    Hash indexes over the rows of a ServerColumns.
+
+    They only depend on the logicals themselves (and not on loads),
+    so they are rebuilt once per data version of the toplevel list.
+    Each index is built the first time it is used.
+
+    When the list comes from a ServerListSnapshot, name, ID and exit IP
+    lookups use the sorted tables stored in the snapshot instead, so
+    that they don't require decoding the logicals.
+
+    Country codes are indexed upper-cased, cities and server names
+    lower-cased, so that lookups are case insensitive.
+    """
+    def __init__(self, columns, logicals, snapshot=None):
+        self.row_count = len(columns)
+        self._columns = columns
+        self._logicals = logicals
+        self._snapshot = snapshot
+        self.__indexes = {}
+
+    def __index(self, name, build):
+        index = self.__indexes.get(name)
+        if index is None:
+            index = build()
+            self.__indexes[name] = index
+
+        return index
+
+    @property
+    def name(self):
+        return self.__index("name", lambda: {
+            name.lower(): row for row, name in enumerate(self._columns.name)
+        })
+
+    @property
+    def sorted_names(self):
+        # Sorted names, to answer prefix queries with a binary search
+        return self.__index("sorted_names", lambda: sorted(self.name))
+
+    @property
+    def id(self):
+        return self.__index("id", lambda: {
+            logical_id: row for row, logical_id in enumerate(self._columns.id)
+        })
+
+    @property
+    def exit_country(self):
+        return self.__index("exit_country", lambda: self.__index_strings(
+            self._columns.exit_country, lambda value: value.upper()
+        ))
+
+    @property
+    def entry_country(self):
+        return self.__index("entry_country", lambda: self.__index_strings(
+            self._columns.entry_country, lambda value: value.upper()
+        ))
+
+    @property
+    def city(self):
+        return self.__index("city", lambda: self.__index_strings(
+            self._columns.city, lambda value: value.lower()
+        ))
+
+    @property
+    def features(self):
+        return self.__index("features", self.__index_features)
+
+    @property
+    def exit_ip(self):
+        return self.__index("exit_ip", self.__index_exit_ips)
+
+    @property
+    def search(self):
+        return self.__index("search", lambda: ServerSearchIndex(self._columns))
+
+    @staticmethod
+    def __index_strings(column, normalize):
+        rows_by_code = {}
+        for row, code in enumerate(column.codes):
+            rows_by_code.setdefault(code, set()).add(row)
+
+        index = {}
+        for code, rows in rows_by_code.items():
+            value = column.values[code]
+            if value is not None:
+                value = normalize(value)
+            index.setdefault(value, set()).update(rows)
+
+        return index
+
+    def __index_features(self):
+        index = {
+            feature: set()
+            for feature in FeatureEnum.list()
+            if feature != FeatureEnum.NORMAL
+        }
+        for row, server_features in enumerate(self._columns.features):
+            if server_features == 0:
+                continue
+            for feature, rows in index.items():
+                if server_features & feature:
+                    rows.add(row)
+
+        return index
+
+    def __index_exit_ips(self):
+        """
+        Map each exit IP to (row, domain).
+
+        The domain is the one of the last physical server with that IP in
+        the first logical having it, non secure core logicals first.
+        """
+        if self._snapshot is not None:
+            return dict(self._snapshot.exit_ip_items())
+
+        features = self._columns.features
+        exit_ip = {}
+        for row, logical in enumerate(self._logicals):
+            secure_core = features[row] & FeatureEnum.SECURE_CORE
+            for physical in logical["Servers"]:
+                ip = physical["ExitIP"]
+                current = exit_ip.get(ip)
+                if (
+                    current is None
+                    or current[0] == row
+                    or (
+                        features[current[0]] & FeatureEnum.SECURE_CORE
+                        and not secure_core
+                    )
+                ):
+                    exit_ip[ip] = (row, physical["Domain"])
+
+        return exit_ip
+
+    def row_by_name(self, name):
+        """Return the row of a server name (case insensitive), or None."""
+        if self._snapshot is not None:
+            return self._snapshot.row_by_name(name)
+
+        return self.name.get(name.lower())
+
+    def row_by_id(self, logical_id):
+        """Return the row of a logical ID, or None."""
+        if self._snapshot is not None:
+            return self._snapshot.row_by_id(logical_id)
+
+        return self.id.get(logical_id)
+
+    def row_by_exit_ip(self, ip):
+        """Return (row, domain) for an exit IP, or None."""
+        if self._snapshot is not None:
+            return self._snapshot.exit_ip(ip)
+
+        return self.exit_ip.get(ip)
+
+    def names_with_prefix(self, prefix):
+        """Return the (lower-cased) names starting with prefix, sorted."""
+        if self._snapshot is not None:
+            return self._snapshot.names_with_prefix(prefix)
+
+        prefix = prefix.lower()
+        # Every name starting with prefix sorts before prefix + U+FFFF
+        start = bisect.bisect_left(self.sorted_names, prefix)
+        end = bisect.bisect_left(self.sorted_names, prefix + "\uffff", start)
+
+        return self.sorted_names[start:end]
+
+    def lookup(
+        self, name=None, exit_country=None, entry_country=None, city=None,
+        features=(), max_tier=None
+    ):
+        """Return the set of rows matching all the given criteria."""
+        candidates = []
+        if name is not None:
+            row = self.row_by_name(name)
+            candidates.append(set() if row is None else {row})
+        if exit_country is not None:
+            candidates.append(self.exit_country.get(exit_country.upper(), set()))
+        if entry_country is not None:
+            candidates.append(self.entry_country.get(entry_country.upper(), set()))
+        if city is not None:
+            candidates.append(self.city.get(city.lower(), set()))
+        for feature in features:
+            if feature != FeatureEnum.NORMAL:
+                candidates.append(self.features[feature])
+        # Rows are grouped by tier, so the rows up to a tier are a prefix
+        end = self.row_count
+        if max_tier is not None:
+            end = self._columns.rows_up_to_tier(max_tier).stop
+
+        if len(candidates) == 0:
+            rows = set(range(end))
+        else:
+            # Intersect starting from the smallest set, so that the cost
+            # is bounded by the number of matching servers
+            candidates.sort(key=len)
+            rows = {row for row in candidates[0] if row < end}
+            for other in candidates[1:]:
+                rows.intersection_update(other)
+
+        return rows
@@ -0,0 +1,113 @@
+import struct
+import zlib
+
+# Append-only journal of load updates, applied on top of a
+# ServerListSnapshot.
+#
+# Layout (little endian):
+# - header: magic, format version, row count and logicals update
+#   timestamp of the snapshot the journal applies to
+# - entries, appended one per load update:
+#   - loads update timestamp, number of changes, CRC32 of the changes
+#   - for each change: row, score, load, status
+#
+# A journal is only valid for the snapshot it was started for, it is
+# dropped (compacted) whenever a new snapshot is written.
+#
+# Reading stops at the first incomplete or corrupted entry (ie write
+# interrupted by a crash), and appending starts by truncating the journal
+# to its valid length (journal_length), so that a torn entry is never
+# followed by other entries.
+MAGIC = b"PVLJ"
+FORMAT_VERSION = 2
+HEADER = struct.Struct("<4sHHId")
+ENTRY = struct.Struct("<dII")
+CHANGE = struct.Struct("<IdBB")
+
+
+def journal_header(row_count, logicals_update_timestamp):
+    """Return the header of a journal for a snapshot."""
+    return HEADER.pack(
+        MAGIC, FORMAT_VERSION, 0, row_count, logicals_update_timestamp
+    )
+
+
+def journal_entry(loads_update_timestamp, changes):
+    """
+    Serialize one load update.
+
+    Args:
+        loads_update_timestamp (float)
+        changes (list): (row, load, score, status) tuples
+    Returns:
+        bytes
+    """
+    data = b"".join(
+        CHANGE.pack(row, score, load, status)
+        for row, load, score, status in changes
+    )
+    return ENTRY.pack(
+        loads_update_timestamp, len(changes), zlib.crc32(data)
+    ) + data
+
+
+def read_journal(buffer, row_count, logicals_update_timestamp):
+    """
+    Iterate over the entries of a journal, as
+    (loads update timestamp, [(row, load, score, status), ...]).
+
+    Nothing is returned if the journal belongs to another snapshot.
+    Entries from the first incomplete or corrupted one are ignored.
+    """
+    for timestamp, changes, _ in _entries(
+        buffer, row_count, logicals_update_timestamp
+    ):
+        yield timestamp, changes
+
+
+def journal_length(buffer, row_count, logicals_update_timestamp):
+    """
+    Return the length of the valid part of a journal (header and valid
+    entries), 0 if it belongs to another snapshot.
+    """
+    buffer = memoryview(buffer)
+    if not _valid_header(buffer, row_count, logicals_update_timestamp):
+        return 0
+
+    end = HEADER.size
+    for _, _, end in _entries(buffer, row_count, logicals_update_timestamp):
+        pass
+
+    return end
+
+
+def _valid_header(buffer, row_count, logicals_update_timestamp):
+    return (
+        len(buffer) >= HEADER.size
+        and bytes(buffer[:HEADER.size]) == journal_header(
+            row_count, logicals_update_timestamp
+        )
+    )
+
+
+def _entries(buffer, row_count, logicals_update_timestamp):
+    buffer = memoryview(buffer)
+    if not _valid_header(buffer, row_count, logicals_update_timestamp):
+        return
+
+    offset = HEADER.size
+    while offset + ENTRY.size <= len(buffer):
+        timestamp, count, checksum = ENTRY.unpack_from(buffer, offset)
+        start = offset + ENTRY.size
+        end = start + count * CHANGE.size
+        if end > len(buffer) or zlib.crc32(buffer[start:end]) != checksum:
+            return
+
+        changes = []
+        for change_offset in range(start, end, CHANGE.size):
+            row, score, load, status = CHANGE.unpack_from(buffer, change_offset)
+            if row < row_count:
+                changes.append((row, load, score, status))
+
+        offset = end
+        yield timestamp, changes, end
@@ -1,17 +1,48 @@
+import collections
+import heapq
+import io
 import json
 import random
 import time
-import weakref
 
 from ... import exceptions
 from ...enums import FeatureEnum
 from ...logger import logger
 from ..environment import ExecutionEnvironment
+from .cache import LRUCache
+from .changes import compute_changes
+from .columns import ServerColumns
+from .countries import CountryTree
+from .indexes import ServerIndexes
+from .journal import (journal_entry, journal_header, journal_length,
+                      read_journal)
+from .parser import compact_logical, load_logicals
+from .query import ServerQuery
+from .snapshot import LazyLogicals, ServerListSnapshot
 # For simplification, we'll use format as coming from the API here,
 # although that might not be a good approach for genericity
 
+# Unpacked features of each bitmask value, there are only a few of them
+_FEATURES_BY_BITMAP = {}
+
+
+def _unpack_bitmap_features(server_value):
+    server_features = _FEATURES_BY_BITMAP.get(server_value)
+    if server_features is None:
+        server_features = tuple(
+            feature_enum
+            for feature_enum
+            in FeatureEnum.list()
+            if (server_value & feature_enum) != 0 or feature_enum == 0
+        )
+        _FEATURES_BY_BITMAP[server_value] = server_features
+
+    return server_features
+
 
 class PhysicalServer:
+    __slots__ = ("_data",)
+
     def __init__(self, data):
         self._data = data
 
@@ -69,9 +100,21 @@ class LogicalServer:
     Beware that this is intended to be a short-lived object,
     if ServerList reloads completely, a LogicalServer will not
     retain its bound to the list.
+
+    ServerList keeps one instance per logical (until the logicals are
+    reloaded) and hands out that same instance every time.
+
+    Derived fields (enabled, features) are computed once: ServerList
+    passes the values it computed when the list was updated, otherwise
+    they are computed on first access.
     """
-    def __init__(self, data):
+    __slots__ = ("_data", "_physical_servers", "_enabled", "_features")
+
+    def __init__(self, data, enabled=None):
         self._data = data
+        self._physical_servers = None
+        self._enabled = enabled
+        self._features = None
 
     @property
     def id(self):
@@ -96,13 +139,16 @@ class LogicalServer:
 
     @property
     def enabled(self):
-        return self._data["Status"] == 1 and any(
-            x.enabled for x in self.physical_servers
-        )
+        if self._enabled is None:
+            self._enabled = self._data["Status"] == 1 and any(
+                x["Status"] == 1 for x in self._data["Servers"]
+            )
+        return self._enabled
 
     @enabled.setter
     def enabled(self, newvalue):
         self._data["Status"] = newvalue
+        self._enabled = None
 
     # Every other propriety is readonly
     @property
@@ -124,16 +170,9 @@ class LogicalServer:
     # We do not expose on purpose the domain, it should be deprecated soob
     @property
     def features(self):
-        return self.__unpack_bitmap_features(self._data["Features"])
-
-    def __unpack_bitmap_features(self, server_value):
-        server_features = [
-            feature_enum
-            for feature_enum
-            in FeatureEnum.list()
-            if (server_value & feature_enum) != 0 or feature_enum == 0
-        ]
-        return server_features
+        if self._features is None:
+            self._features = _unpack_bitmap_features(self._data["Features"])
+        return list(self._features)
 
     @property
     def region(self):
@@ -161,7 +200,11 @@ class LogicalServer:
 
     @property
     def physical_servers(self):
-        return [PhysicalServer(x) for x in self._data["Servers"]]
+        if self._physical_servers is None:
+            self._physical_servers = tuple(
+                PhysicalServer(x) for x in self._data["Servers"]
+            )
+        return list(self._physical_servers)
 
     def get_random_physical_server(self):
         enabled_servers = [x for x in self.physical_servers if x.enabled]
@@ -171,10 +214,159 @@ class LogicalServer:
 
         return random.choice(enabled_servers)
 
+    def get_physical_server(self, selector=None):
+        """
+        Get a physical server, chosen by selector.
+
+        Args:
+            selector (PhysicalServerSelector): if None, an enabled
+                physical server is picked at random
+        Returns:
+            PhysicalServer
+        """
+        if selector is None:
+            return self.get_random_physical_server()
+
+        return selector.select(self)
+
     def __repr__(self):
         return 'LogicalServer<{}>'.format(self._data.get("Name", "??"))
 
 
+class AllConditions:
+    """Condition matching when all of the given conditions match."""
+    def __init__(self, *conditions):
+        self.conditions = []
+        for condition in conditions:
+            if isinstance(condition, AllConditions):
+                self.conditions.extend(condition.conditions)
+            else:
+                self.conditions.append(condition)
+
+    def __call__(self, server):
+        return all(condition(server) for condition in self.conditions)
+
+
+class ServerListState:
+    """
+    Content of a toplevel ServerList at a given version: the logicals,
+    their columns and indexes.
+
+    A state is never modified once it is published by the toplevel
+    list: updates build a new state (sharing everything that didn't
+    change) and the list switches to it with a single reference
+    assignment. Readers that got a state keep a consistent view of
+    the servers, without locking, even while the list is refreshed
+    in another thread.
+
+    The only mutations are caches (interned LogicalServer instances,
+    lazily decoded logicals and lazily built indexes), which are
+    idempotent.
+    """
+    def __init__(
+        self, data, columns, snapshot=None, indexes=None,
+        version=0, data_version=0, servers=None
+    ):
+        self.data = data
+        self.columns = columns
+        self.snapshot = snapshot
+        self.indexes = indexes if indexes is not None else ServerIndexes(
+            columns, data["LogicalServers"], snapshot
+        )
+        self.version = version
+        self.data_version = data_version
+        # Interned LogicalServers, by row
+        self.servers = servers if servers is not None else {}
+        self._countries = None
+
+    @classmethod
+    def load(cls, previous, data, columns, snapshot=None):
+        """Create the state following previous, with new logicals."""
+        return cls(
+            data, columns, snapshot,
+            version=previous.version + 1,
+            data_version=previous.data_version + 1
+        )
+
+    def server(self, row):
+        """
+        Get the LogicalServer of a row.
+
+        Instances are interned per row, so that iterating, sorting or
+        filtering the lists does not allocate a new object per server.
+        """
+        server = self.servers.get(row)
+        if server is None:
+            server = LogicalServer(
+                self.data["LogicalServers"][row],
+                enabled=bool(self.columns.enabled[row])
+            )
+            self.servers[row] = server
+
+        return server
+
+    @property
+    def countries(self):
+        """CountryTree of all the servers, built on first use."""
+        if self._countries is None:
+            self._countries = CountryTree(self.columns)
+
+        return self._countries
+
+    def with_loads(self, changes, loads_update_timestamp):
+        """
+        Create the state following this one, with updated loads.
+
+        Only the load columns, and the logicals that were already decoded
+        and changed, are copied.
+
+        Args:
+            changes (dict): row -> (load, score, status)
+            loads_update_timestamp (float)
+        """
+        columns = self.columns.copy()
+        logicals = self.data["LogicalServers"]
+        if isinstance(logicals, LazyLogicals):
+            logicals = logicals.copy(columns)
+        else:
+            logicals = list(logicals)
+        servers = dict(self.servers)
+
+        for row, (load, score, status) in changes.items():
+            columns.update_loads(row, load, score, status)
+            servers.pop(row, None)
+
+            # Logicals of a snapshot that were not decoded yet will
+            # get their loads from the columns
+            if isinstance(logicals, LazyLogicals):
+                logical = logicals.loaded(row)
+            else:
+                logical = logicals[row]
+            if logical is not None:
+                logical = dict(logical)
+                server = LogicalServer(logical)
+                server.load = columns.load[row]
+                server.score = columns.score[row]
+                server.enabled = columns.status[row]
+                logicals[row] = logical
+
+        data = dict(self.data)
+        data["LogicalServers"] = logicals
+        data["LoadsUpdateTimestamp"] = loads_update_timestamp
+
+        # Indexes don't depend on loads, they are shared
+        state = ServerListState(
+            data, columns, self.snapshot, self.indexes,
+            version=self.version + 1,
+            data_version=self.data_version,
+            servers=servers
+        )
+        if self._countries is not None:
+            state._countries = self._countries.with_loads(columns, changes)
+
+        return state
+
+
 class ServerList:
     """
     This class handles the list of logicals.
@@ -187,8 +379,41 @@ class ServerList:
     All of these classes refer have an _ids property, which is the list of
     toplevel indices (logicals) this class has access to.
 
-    When the toplevel
+    Logicals are grouped by tier when loaded: lists (unless sorted)
+    iterate over the servers by increasing tier, and in the order of
+    the API within a tier, not in the order of the API.
+
+    The content of the toplevel list is a ServerListState, which is
+    replaced (never modified) when the list is updated. Every list
+    remembers the state its _ids were computed against, and only
+    re-applies its criteria (and sort) the next time it is accessed
+    after an update. The toplevel list does not keep track of its
+    sublists, so the ones that are not used anymore are simply garbage
+    collected.
+
+    The toplevel list can be imported from and exported to JSON
+    (json_load/json_dumps), or to a binary ServerListSnapshot
+    (load_snapshot/dump_snapshot) that is memory mapped and only
+    decodes the logicals which are actually used. Load updates
+    applied since then can be saved as a journal entry
+    (dump_load_delta) and replayed on the snapshot (replay_load_journal).
+
+    Rows of sublists defined by ServerQuery conditions (and sorted on
+    a column, if at all) are kept in an LRU cache of the toplevel list,
+    keyed on the queries, sort and version, so asking the same question
+    again after a refresh costs a dictionary lookup
+    (see query_cache_info).
+
+    Every update of the toplevel list also computes a ServerListChanges
+    (servers added, removed, enabled, disabled and load/score changes of
+    at least LOAD_CHANGE_THRESHOLD/SCORE_CHANGE_THRESHOLD), passed to the
+    subscribed callbacks and kept for changes_since().
     """
+    QUERY_CACHE_SIZE = 128
+    CHANGES_HISTORY_SIZE = 32
+    LOAD_CHANGE_THRESHOLD = 5
+    SCORE_CHANGE_THRESHOLD = 0.1
+
     def __init__(
         self, toplevel=None,
         condition=None,
@@ -198,28 +423,97 @@ class ServerList:
         if toplevel is not None:
             assert isinstance(toplevel, self.__class__)
             self._toplevel = toplevel
-            self._toplevel._views.add(self)
             self._condition = condition
-            self._views = set()
         else:
             assert condition is None
 
             self._toplevel = None
             self._condition = None
-            self.__data = {'LogicalServers': {}}
-            self._views = weakref.WeakSet()
+            self.__state = ServerListState(
+                {'LogicalServers': []}, ServerColumns()
+            )
+            self.__changed_rows = set()
+            self.__query_cache = LRUCache(self.QUERY_CACHE_SIZE)
+            self.__changes = collections.deque(
+                maxlen=self.CHANGES_HISTORY_SIZE
+            )
+            self.__subscribers = []
 
         self._sort_key = sort_key
         self._sort_reverse = sort_reverse
 
-        self.refresh_indexes()
+        # (state, ids, set of ids, cache of values derived from the ids),
+        # replaced at once so that readers always get ids matching the state
+        self.__current = None
+
+        if self.is_toplevel:
+            self.refresh_indexes()
+
+    @property
+    def version(self):
+        """Counter increased every time the toplevel list is updated."""
+        return self._toplevel_list.__state.version
+
+    def _current(self):
+        current = self.__current
+        if current is None or current[0] is not self._toplevel_list.__state:
+            current = self.refresh_indexes()
+
+        return current
+
+    @property
+    def _state(self):
+        """The ServerListState this list currently reflects."""
+        return self._current()[0]
+
+    @property
+    def _ids(self):
+        return self._current()[1]
+
+    def __row_in_list(self, current, row):
+        if row is None or self.is_toplevel:
+            return row
+
+        return row if row in current[2] else None
+
+    def _row_by_id(self, logical_id):
+        """Get the toplevel row of a logical ID of this list, or None."""
+        current = self._current()
+        return self.__row_in_list(
+            current, current[0].indexes.row_by_id(logical_id)
+        )
+
+    def _row_by_name(self, name):
+        """Get the toplevel row of a server name of this list, or None."""
+        current = self._current()
+        return self.__row_in_list(
+            current, current[0].indexes.row_by_name(name)
+        )
 
     @property
     def _data(self):
-        if self.is_toplevel:
-            return self.__data
-        else:
-            return self._toplevel.__data
+        return self._state.data
+
+    @property
+    def _columns(self):
+        return self._state.columns
+
+    @property
+    def _indexes(self):
+        return self._state.indexes
+
+    @property
+    def data_version(self):
+        """Counter increased every time the logicals are replaced."""
+        return self._toplevel_list.__state.data_version
+
+    @property
+    def _toplevel_list(self):
+        return self if self.is_toplevel else self._toplevel
+
+    def _server(self, row):
+        """Get the (interned) LogicalServer of a toplevel row."""
+        return self._state.server(row)
 
     @property
     def is_toplevel(self):
@@ -240,16 +534,133 @@ class ServerList:
     def loads_update_timestamp(self):
         return self._data.get('LoadsUpdateTimestamp', 0.)
 
+    def __publish(self, state, rows=None):
+        previous = self.__state
+        # A single assignment, so that readers either see the previous
+        # or the new state
+        self.__state = state
+        # Cached rows of previous versions can't be hit anymore
+        self.__query_cache.clear()
+        self.refresh_indexes()
+
+        changes = compute_changes(
+            previous.columns, state.columns,
+            previous.version, state.version, rows,
+            self.LOAD_CHANGE_THRESHOLD, self.SCORE_CHANGE_THRESHOLD
+        )
+        self.__changes.append(changes)
+        for callback, dispatcher in list(self.__subscribers):
+            if dispatcher is None:
+                self.__notify(callback, changes)
+                continue
+
+            try:
+                dispatcher(self.__notify, callback, changes)
+            except Exception as e:
+                logger.exception(
+                    "Server list subscriber dispatch failed: {}".format(e)
+                )
+
+    @staticmethod
+    def __notify(callback, changes):
+        try:
+            callback(changes)
+        except Exception as e:
+            logger.exception(
+                "Server list subscriber failed: {}".format(e)
+            )
+
+        # So that GLib.idle_add() doesn't call it again
+        return False
+
+    def subscribe(self, callback, dispatcher=None):
+        """
+        Call callback(changes) after each update of the list, with
+        the ServerListChanges of the update.
+
+        Updates are made by the thread refreshing the caches, which may
+        be a background thread: without dispatcher, callback runs there.
+        Otherwise dispatcher(function, *args) is called to have
+        function(*args) run elsewhere, ie GLib.idle_add to run callback
+        in the main loop.
+        """
+        self.ensure_toplevel()
+        self.__subscribers.append((callback, dispatcher))
+
+    def unsubscribe(self, callback):
+        self.ensure_toplevel()
+        for subscriber in self.__subscribers:
+            if subscriber[0] == callback:
+                self.__subscribers.remove(subscriber)
+                return
+
+        raise ValueError("{} is not subscribed".format(callback))
+
+    def changes_since(self, version):
+        """
+        Get the ServerListChanges of the updates after version, oldest
+        first.
+
+        Returns:
+            list: or None if version is too old to be in the history,
+                in which case the whole list has to be read again
+        """
+        changes = list(self._toplevel_list.__changes)
+        if version >= self.version:
+            return []
+        if len(changes) == 0 or changes[0].previous_version > version:
+            return None
+
+        return [change for change in changes if change.version > version]
+
+    def query_cache_info(self):
+        """
+        Statistics of the query cache, as (hits, misses, maxsize, currsize).
+        """
+        return self._toplevel_list.__query_cache.info()
+
+    def __query_cache_key(self, conditions, state):
+        if self.is_toplevel or not all(
+            isinstance(c, ServerQuery) for c in conditions
+        ):
+            return None
+        if self._sort_key is not None and not isinstance(self._sort_key, str):
+            return None
+
+        return (
+            tuple(conditions), self._sort_key, self._sort_reverse,
+            state.version
+        )
+
+    def __load(self, data, columns=None, snapshot=None):
+        if columns is None:
+            # Group the servers by tier, so that the rows of the tiers
+            # a user can use are a contiguous prefix (see
+            # ServerColumns.rows_up_to_tier), in memory as well as in
+            # snapshots
+            data["LogicalServers"].sort(key=lambda logical: logical["Tier"])
+            columns = ServerColumns(data["LogicalServers"])
+
+        self.__changed_rows = set()
+        self.__publish(ServerListState.load(
+            self.__state, data, columns, snapshot
+        ))
+
     def json_dumps(self):
         self.ensure_toplevel()
-        return json.dumps(self._data)
+        data = self._data
+        if isinstance(data["LogicalServers"], LazyLogicals):
+            data = dict(data, LogicalServers=list(data["LogicalServers"]))
+
+        return json.dumps(data)
 
     def json_loads(self, data):
-        self.ensure_toplevel()
-        self.__data = json.loads(data)
+        self.json_load(io.StringIO(data))
 
-        # Refresh indexes
-        self.refresh_indexes()
+    def json_load(self, fp):
+        """Load the list from a file object, without decoding it at once."""
+        self.ensure_toplevel()
+        self.__load(load_logicals(fp))
 
     def update_logical_data(self, data):
         assert 'Code' in data
@@ -260,12 +671,118 @@ class ServerList:
         if data["Code"] != 1000:
             raise ValueError("Invalid data with code != 1000")
 
-        self.__data = data
+        # Only keep the fields we use, so that the rest of the payload
+        # can be freed as soon as the caller drops it
+        logicals = [
+            compact_logical(logical) for logical in data["LogicalServers"]
+        ]
+        data = dict(data)
+        data["LogicalServers"] = logicals
         # We update both LastLogicalUpdate and LastLoadUpdate, as Load contains
-        self.__data["LogicalsUpdateTimestamp"] = time.time()
-        self.__data["LoadsUpdateTimestamp"] = time.time()
+        data["LogicalsUpdateTimestamp"] = time.time()
+        data["LoadsUpdateTimestamp"] = time.time()
+        self.__load(data)
 
-        self.refresh_indexes()
+    def dump_snapshot(self):
+        """Serialize the list to the ServerListSnapshot format (bytes)."""
+        self.ensure_toplevel()
+        state = self.__state
+        self.__changed_rows = set()
+        return ServerListSnapshot.dumps(state.data, state.columns, state.indexes)
+
+    def load_snapshot(self, snapshot):
+        """
+        Load the list from a snapshot.
+
+        Args:
+            snapshot (ServerListSnapshot|bytes): snapshot, or the content
+                of a snapshot file. Use ServerListSnapshot.open(path)
+                to memory map a file.
+        """
+        self.ensure_toplevel()
+        if not isinstance(snapshot, ServerListSnapshot):
+            snapshot = ServerListSnapshot(snapshot)
+
+        columns = ServerColumns.from_snapshot(snapshot)
+        self.__load({
+            "Code": 1000,
+            "LogicalServers": LazyLogicals(snapshot, columns),
+            "LogicalsUpdateTimestamp": snapshot.logicals_update_timestamp,
+            "LoadsUpdateTimestamp": snapshot.loads_update_timestamp,
+        }, columns, snapshot)
+
+    def load_journal_header(self):
+        """Header of the load journal of the current logicals."""
+        self.ensure_toplevel()
+        return journal_header(
+            len(self.__state.columns), self.logicals_update_timestamp
+        )
+
+    def load_journal_length(self, buffer):
+        """
+        Length of the valid part of a load journal (see journal_length),
+        0 if it was not started for the current logicals.
+        """
+        self.ensure_toplevel()
+        return journal_length(
+            buffer, len(self.__state.columns), self.logicals_update_timestamp
+        )
+
+    def dump_load_delta(self):
+        """
+        Serialize the loads changed since the last dump (of a delta or
+        of a snapshot) as a journal entry, to be appended to the journal
+        started with load_journal_header().
+
+        Returns:
+            bytes: empty if no load changed
+        """
+        self.ensure_toplevel()
+        if len(self.__changed_rows) == 0:
+            return b""
+
+        columns = self.__state.columns
+        changes = [
+            (row, columns.load[row], columns.score[row], columns.status[row])
+            for row in sorted(self.__changed_rows)
+        ]
+        self.__changed_rows = set()
+        return journal_entry(self.loads_update_timestamp, changes)
+
+    def replay_load_journal(self, buffer):
+        """
+        Apply the entries of a load journal, if it was started for the
+        current logicals (it is ignored otherwise).
+        """
+        self.ensure_toplevel()
+        state = self.__state
+        changes = {}
+        timestamp = None
+        for timestamp, entry_changes in read_journal(
+            buffer, len(state.columns), self.logicals_update_timestamp
+        ):
+            for row, load, score, status in entry_changes:
+                changes[row] = (load, score, status)
+
+        if timestamp is not None:
+            changes = self.__changed_loads(state.columns, changes)
+            self.__publish(state.with_loads(changes, timestamp), changes)
+
+        # Replayed loads are already in the journal
+        self.__changed_rows = set()
+
+    @staticmethod
+    def __changed_loads(columns, changes):
+        """Keep the changes that actually modify a row."""
+        return {
+            row: (load, score, status)
+            for row, (load, score, status) in changes.items()
+            if (
+                columns.load[row] != int(load)
+                or columns.score[row] != float(score)
+                or columns.status[row] != int(status)
+            )
+        }
 
     def update_load_data(self, data):
         assert 'Code' in data
@@ -276,56 +793,99 @@ class ServerList:
         if data["Code"] != 1000:
             raise ValueError("Invalid data with code != 1000")
 
-        self.__data["LoadsUpdateTimestamp"] = time.time()
-
+        state = self.__state
+        columns = state.columns
+        changes = {}
         for s in data["LogicalServers"]:
-            if s["ID"] not in self._logicals_by_id:
+            row = state.indexes.row_by_id(s["ID"])
+            if row is None:
                 # This server doesn't exists in the cached list
                 continue
-            server = self[s["ID"]]
 
-            server.load = s.get("Load", server.load)
-            server.score = s.get("Score", server.score)
-            server.enabled = s.get("Status", server.enabled)
+            changes[row] = (
+                s.get("Load", columns.load[row]),
+                s.get("Score", columns.score[row]),
+                s.get("Status", columns.status[row])
+            )
+
+        changes = self.__changed_loads(columns, changes)
+        self.__changed_rows.update(changes)
 
         # Required to sort lists again if needed
-        self.refresh_indexes()
+        self.__publish(state.with_loads(changes, time.time()), changes)
 
     def refresh_indexes(self):
-        # Create indexes
-        self._ids = []
-        self._logicals_by_id = {}
-        self._logicals_by_name = {}
-
-        # Re-apply filter condition (if any)
-        for logical_id, logical in enumerate(self._data["LogicalServers"]):
-            server = LogicalServer(logical)
-            if self._condition is None or self._condition(server):
-                self._logicals_by_id[logical["ID"]] = logical_id
-                self._logicals_by_name[logical["ID"]] = logical_id
-                self._ids.append(logical_id)
-
-        # Re-apply filter condition on children (if any)
-        for v in self._views:
-            v.refresh_indexes()
-
-        # Sort (if needed)
-        self._sort()
+        """
+        Re-compute (and sort) the rows of this list, against the current
+        state of the toplevel list.
+        """
+        state = self._toplevel_list.__state
+
+        if self._condition is None:
+            conditions = []
+        elif isinstance(self._condition, AllConditions):
+            conditions = self._condition.conditions
+        else:
+            conditions = [self._condition]
+
+        cache = self._toplevel_list.__query_cache
+        cache_key = self.__query_cache_key(conditions, state)
+        if cache_key is not None:
+            current = cache.get(cache_key)
+            if current is not None:
+                self.__current = current
+                return current
+
+        # Conditions that can be answered by the indexes restrict the
+        # rows to look at, the others are evaluated on each remaining row
+        indexed_rows = [
+            c.rows(state) for c in conditions if hasattr(c, "rows")
+        ]
+        conditions = [c for c in conditions if not hasattr(c, "rows")]
+        if len(indexed_rows) > 0:
+            rows = sorted(set.intersection(*indexed_rows))
+        else:
+            rows = range(len(state.columns))
+
+        # Re-apply filter condition (if any), without touching the
+        # logicals when there is none (ie the toplevel list, whose ids
+        # stay a range)
+        if len(conditions) > 0:
+            ids = [
+                row for row in rows
+                if all(c(state.server(row)) for c in conditions)
+            ]
+        else:
+            ids = rows
+
+        # Sort (if needed), ids are in increasing order at this point
+        ids = self.__sorted(state, ids, ordered=True)
+        current = (state, ids, set(ids) if not self.is_toplevel else None, {})
+        if cache_key is not None:
+            cache.put(cache_key, current)
+
+        self.__current = current
+        return current
 
     def __len__(self):
         return len(self._ids)
 
     def __getitem__(self, idx):
         if type(idx) == str:
-            internal_idx = self._logicals_by_id[idx]
-        else:
-            internal_idx = self._ids[idx]
+            internal_idx = self._row_by_id(idx)
+            if internal_idx is None:
+                raise KeyError(idx)
+            return self._server(internal_idx)
 
-        return LogicalServer(self._data["LogicalServers"][internal_idx])
+        state, ids, _, _ = self._current()
+        return state.server(ids[idx])
 
     def __iter__(self):
-        for idx in range(len(self)):
-            yield self[idx]
+        # Iterate over the state at the time iteration started, even if
+        # the list is updated meanwhile
+        state, ids, _, _ = self._current()
+        for row in ids:
+            yield state.server(row)
 
     def __repr__(self):
         if self.is_toplevel:
@@ -341,51 +901,208 @@ class ServerList:
         else:
             return ServerList(
                 self._toplevel,
-                lambda x: self._condition(x) and condition(x)
+                AllConditions(self._condition, condition)
             )
 
+    def where(self, **criteria):
+        """
+        Shortcut for filter(ServerQuery(**criteria)), ie:
+        sl.where(exit_country="CH", exclude_features=[FeatureEnum.TOR])
+        """
+        return self.filter(ServerQuery(**criteria))
+
+    def get_server_by_name(self, servername):
+        """Get a server of this list by its name (case insensitive)."""
+        current = self._current()
+        internal_idx = self.__row_in_list(
+            current, current[0].indexes.row_by_name(servername)
+        )
+        if internal_idx is None:
+            logger.error("Server \"{}\" not found".format(servername))
+            raise exceptions.EmptyServerListError(
+                "No logical server could be found"
+            )
+
+        return current[0].server(internal_idx)
+
+    def get_servernames_with_prefix(self, prefix):
+        """
+        Get the names of the servers starting with prefix (case insensitive),
+        in alphabetical order. Useful for shell completion, ie "CH#"
+        or "US-NY#".
+        """
+        current = self._current()
+        indexes = current[0].indexes
+        rows = [
+            self.__row_in_list(current, indexes.row_by_name(name))
+            for name in indexes.names_with_prefix(prefix)
+        ]
+        return [
+            current[0].columns.name[row] for row in rows if row is not None
+        ]
+
+    def search(self, text, limit=10, max_tier=None):
+        """
+        Full-text search of the servers of this list, most relevant first.
+
+        Every word of text must start a word of the server name, exit
+        country (code or name), city, region or of a feature keyword
+        (ie "secure", "tor", "p2p", "streaming"), so partial input already
+        matches. Servers of equal relevance are sorted by score.
+
+        Example: sl.search("swi p2p") or sl.search("new yo")
+
+        Args:
+            text (str): query
+            limit (int): maximum number of servers to return, or None
+            max_tier (int): leave out servers above this tier
+        Returns:
+            list: LogicalServer
+        """
+        state, _, rowset, _ = self._current()
+        end = None
+        if max_tier is not None:
+            end = state.columns.rows_up_to_tier(max_tier).stop
+
+        rows = state.indexes.search.search(
+            text, limit, rows=rowset, end=end, scores=state.columns.score
+        )
+        return [state.server(row) for row in rows]
+
     def filter_servers_by_tier(self):
         # Filter servers bye tier
-        server_list = list(self.filter(
-            lambda server: server.tier <= ExecutionEnvironment().api_session.vpn_tier # noqa
-        ))
-        return server_list
+        state, ids, _, _ = self._current()
+        rows = state.columns.select(
+            ids, max_tier=ExecutionEnvironment().api_session.vpn_tier
+        )
+        return [state.server(row) for row in rows]
 
-    def get_random_server(self):
-        self.__ensure_cache_exists()
-        server_list = self.filter_servers_by_tier()
-        return server_list[random.randint(0, len(server_list) - 1)]
+    @property
+    def countries(self):
+        """
+        CountryTree (country -> city -> servers, with load aggregates)
+        of the servers of this list, computed once per version.
+        """
+        state, ids, _, cache = self._current()
+        if self.is_toplevel and self._sort_key is None \
+                and not self._sort_reverse:
+            # Maintained incrementally on load updates
+            return state.countries
 
-    def get_fastest_server(self):
-        # Get the fastest enabled server
+        countries = cache.get("countries")
+        if countries is None:
+            countries = CountryTree(state.columns, ids)
+            cache["countries"] = countries
+
+        return countries
+
+    def get_random_server(self, weighted=False):
+        """
+        Get a random server of the user tier.
+
+        If weighted, less loaded servers are more likely to be picked.
+        """
         self.__ensure_cache_exists()
-        servers_ordered = list(
-            self.filter(
-                lambda server: server.enabled
-                and server.tier <= ExecutionEnvironment().api_session.vpn_tier
-            ).sort(
-                lambda server: server.score
+        return self.sample(
+            max_tier=ExecutionEnvironment().api_session.vpn_tier,
+            weighted=weighted
+        )
+
+    def sample(self, max_tier=None, enabled=False, weighted=False):
+        """
+        Draw a random server of the list, without building a list of
+        the candidates: samplers are computed once per version of the
+        list (and criteria), then each draw is O(1), or O(log n) if
+        weighted by inverse load.
+
+        Example: a random enabled server, preferably not loaded:
+        sl.sample(enabled=True, weighted=True)
+        """
+        state, ids, _, cache = self._current()
+        key = ("sampler", max_tier, bool(enabled), bool(weighted))
+        sampler = cache.get(key)
+        if sampler is None:
+            sampler = state.columns.sampler(
+                ids, max_tier=max_tier, enabled=enabled, weighted=weighted
+            )
+            cache[key] = sampler
+
+        if len(sampler) == 0:
+            logger.error("List of logical servers is empty")
+            raise exceptions.EmptyServerListError(
+                "No logical server could be found"
             )
+
+        return state.server(sampler.draw())
+
+    def top_k(
+        self, key, k, predicate=None, reverse=False,
+        max_tier=None, enabled=False
+    ):
+        """
+        Get the k servers with the smallest key (or the largest, if
+        reverse is True), sorted, in O(n log k).
+
+        key is either a callable on LogicalServer or the name of a numeric
+        column (ie "score"), predicate an optional filter condition.
+        max_tier and enabled are applied directly on the columnar storage.
+
+        Example: the 5 least loaded servers of the list:
+        sl.top_k("load", 5, enabled=True)
+        """
+        state, ids, _, _ = self._current()
+        rows = state.columns.select(ids, max_tier=max_tier, enabled=enabled)
+        if predicate is not None:
+            if hasattr(predicate, "rows"):
+                matching_rows = predicate.rows(state)
+                rows = [row for row in rows if row in matching_rows]
+            else:
+                rows = [row for row in rows if predicate(state.server(row))]
+
+        if isinstance(key, str):
+            rows = state.columns.smallest(rows, key, k, reverse)
+        else:
+            select = heapq.nlargest if reverse else heapq.nsmallest
+            rows = select(k, rows, key=lambda row: key(state.server(row)))
+
+        return [state.server(row) for row in rows]
+
+    def get_fastest_servers(self, k):
+        """Get up to k enabled servers of the user tier, fastest first."""
+        self.__ensure_cache_exists()
+        return self.top_k(
+            "score", k,
+            max_tier=ExecutionEnvironment().api_session.vpn_tier,
+            enabled=True
         )
-        if len(servers_ordered) == 0:
+
+    def get_fastest_server(self):
+        # Get the fastest enabled server
+        servers = self.get_fastest_servers(1)
+        if len(servers) == 0:
             logger.error("List of logical servers is empty")
             raise exceptions.EmptyServerListError(
                 "No logical server could be found"
             )
-        return servers_ordered[0]
+        return servers[0]
 
     def __ensure_cache_exists(self):
         """Ensure that cache exists."""
-        try:
-            if self._toplevel.__data is None:
-                logger.error("Server cache not found")
-                raise exceptions.ServerCacheNotFound("Server cache not found")
-        except AttributeError:
-            if self.__data is None:
-                logger.error("Server cache not found")
-                raise exceptions.ServerCacheNotFound("Server cache not found")
+        if self._toplevel_list.__state.data is None:
+            logger.error("Server cache not found")
+            raise exceptions.ServerCacheNotFound("Server cache not found")
 
     def match_server_domain(self, physical_server):
+        if self.is_toplevel:
+            # Use the exit IP index instead of scanning every physical server
+            state = self._state
+            match = state.indexes.row_by_exit_ip(physical_server.exit_ip)
+            if match is not None:
+                row, domain = match
+                if not state.columns.features[row] & FeatureEnum.SECURE_CORE:
+                    physical_server.domain = domain
+            return
+
         domain = physical_server.domain
 
         for logical_server in self:
@@ -410,23 +1127,41 @@ class ServerList:
 
         Example: sort the servers by name:
         sl.sort(lambda x: x.name)
+
+        key can also be the name of a numeric column (ie "score" or "load"),
+        in which case the sort runs directly on the columnar storage:
+        sl.sort("load")
         """
 
         self._sort_key = key
         self._sort_reverse = reverse
+        current = self.__current
+        if current is None or current[0] is not self._toplevel_list.__state:
+            # Outdated, the list will be sorted when it is refreshed
+            return self
+
         return self._sort()
 
     def _sort(self):
         """Sort (or re-sort) the list"""
+        state, ids, rows, cache = self._current()
+        self.__current = (state, self.__sorted(state, ids), rows, cache)
+
+        # This is practical as we can chain these calls
+        return self
+
+    def __sorted(self, state, ids, ordered=False):
         if self._sort_key is None:
-            self._ids.sort(reverse=self._sort_reverse)
+            if ordered:
+                return ids[::-1] if self._sort_reverse else ids
+            return sorted(ids, reverse=self._sort_reverse)
+        elif isinstance(self._sort_key, str):
+            return state.columns.sort_rows(
+                ids, self._sort_key, self._sort_reverse
+            )
         else:
-            self._ids.sort(
-                key=lambda i: self._sort_key(
-                    LogicalServer(self._data["LogicalServers"][i])
-                ),
+            return sorted(
+                ids,
+                key=lambda i: self._sort_key(state.server(i)),
                 reverse=self._sort_reverse
             )
-
-        # This is practical as we can chain these calls
-        return self
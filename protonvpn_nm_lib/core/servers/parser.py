@@ -0,0 +1,174 @@
+import codecs
+import json
+import sys
+
+# Fields of the /vpn/logicals payload that the library actually uses,
+# everything else is dropped as soon as a logical is parsed.
+LOGICAL_FIELDS = (
+    "ID", "Name", "EntryCountry", "ExitCountry", "HostCountry", "Features",
+    "Region", "City", "Tier", "Load", "Score", "Status", "Location",
+)
+PHYSICAL_FIELDS = (
+    "EntryIP", "ExitIP", "Domain", "Status", "Generation", "Label",
+    "ServicesDownReason",
+)
+# Fields with few distinct values, shared between all the logicals
+INTERNED_FIELDS = ("EntryCountry", "ExitCountry", "HostCountry", "Region", "City")
+
+
+def compact_logical(logical):
+    """Return a copy of logical keeping only the fields in use."""
+    compact = {
+        field: logical[field]
+        for field in LOGICAL_FIELDS
+        if field in logical
+    }
+    for field in INTERNED_FIELDS:
+        if isinstance(compact.get(field), str):
+            compact[field] = sys.intern(compact[field])
+
+    compact["Servers"] = [
+        {
+            field: physical[field]
+            for field in PHYSICAL_FIELDS
+            if field in physical
+        }
+        for physical in logical.get("Servers", [])
+    ]
+    return compact
+
+
+class JSONStream:
+    """
+    Read JSON values one at a time from a (text or binary) file object.
+
+    Only a chunk of the file (plus the value being decoded) is held in
+    memory, which allows to walk through large arrays element by element.
+    """
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, fp):
+        self._fp = fp
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+
+    def _fill(self):
+        """Read one more chunk, return False at the end of the file."""
+        if self._eof:
+            return False
+
+        chunk = self._fp.read(self.CHUNK_SIZE)
+        while isinstance(chunk, bytes):
+            # Bytes ending in the middle of a character decode to less
+            # characters (maybe none), the rest comes with the next read
+            raw_chunk = chunk
+            chunk = self._utf8.decode(raw_chunk, final=not raw_chunk)
+            if not chunk and raw_chunk:
+                chunk = self._fp.read(self.CHUNK_SIZE)
+
+        if not chunk:
+            self._eof = True
+            return False
+
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non whitespace character ("" at the end)."""
+        while True:
+            while (
+                self._pos < len(self._buffer)
+                and self._buffer[self._pos] in " \t\n\r"
+            ):
+                self._pos += 1
+
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+
+            if not self._fill():
+                return ""
+
+    def expect(self, characters):
+        """Consume the next character, which has to be one of characters."""
+        character = self.peek()
+        if character == "" or character not in characters:
+            raise ValueError(
+                "Expected one of \"{}\" at position {}, found \"{}\"".format(
+                    characters, self._pos, character
+                )
+            )
+
+        self._pos += 1
+        return character
+
+    def value(self):
+        """Decode the next JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                # Most likely the value continues in the next chunk
+                if not self._fill():
+                    raise
+                continue
+
+            # A number at the end of the buffer might be truncated
+            # (ie "12.5" read as "12." would decode as 12)
+            if (
+                end == len(self._buffer)
+                or (
+                    isinstance(value, (int, float))
+                    and self._buffer[end] in "0123456789.eE+-"
+                )
+            ) and self._fill():
+                continue
+
+            self._pos = end
+            return value
+
+    def array(self):
+        """Iterate over the elements of the next JSON array."""
+        self.expect("[")
+        if self.peek() == "]":
+            self._pos += 1
+            return
+
+        while True:
+            yield self.value()
+            if self.expect(",]") == "]":
+                return
+
+
+def load_logicals(fp):
+    """
+    Incrementally parse a /vpn/logicals payload (or a cached server list)
+    from a file object.
+
+    Logicals are compacted one by one while reading, so the complete
+    decoded payload never has to be in memory.
+
+    Returns:
+        dict: the payload, with compacted LogicalServers
+    """
+    stream = JSONStream(fp)
+    data = {}
+
+    stream.expect("{")
+    if stream.peek() == "}":
+        return data
+
+    while True:
+        key = stream.value()
+        stream.expect(":")
+        if key == "LogicalServers":
+            data[key] = [compact_logical(logical) for logical in stream.array()]
+        else:
+            data[key] = stream.value()
+
+        if stream.expect(",}") == "}":
+            return data
@@ -0,0 +1,99 @@
+import hashlib
+import random
+import socket
+
+from ... import exceptions
+from ...logger import logger
+
+# Seconds during which a physical server that failed to connect is
+# left out of the selection
+FAILED_SERVER_TTL = 300
+
+
+def host_key():
+    """
+    Identifier of this host, stable across reboots.
+
+    The machine ID is used when available, the hostname otherwise.
+    """
+    for filepath in ("/etc/machine-id", "/var/lib/dbus/machine-id"):
+        try:
+            with open(filepath) as f:
+                machine_id = f.read().strip()
+        except OSError:
+            continue
+
+        if machine_id:
+            return machine_id
+
+    return socket.gethostname()
+
+
+class PhysicalServerSelector:
+    """
+    Strategy choosing the physical server of a logical server.
+
+    Candidates are the enabled physical servers, from which are left out,
+    as long as there are others:
+    - servers that recently failed (failed_entry_ips)
+    - servers having a ServicesDownReason
+
+    The server with the preferred entry IP (ie the one of the previous
+    connection) is picked if it is still a candidate. Otherwise, with a
+    key, servers are picked by rendezvous hashing: the same key gets the
+    same server as long as it is a candidate, and only the keys that were
+    on a server which went away move elsewhere. Without a key, servers
+    are picked at random.
+
+    The API doesn't report loads per physical server (they share the
+    load of their logical), so weighting by load happens when choosing
+    the logical server.
+    """
+    def __init__(self, key=None, preferred_entry_ip=None, failed_entry_ips=()):
+        self.key = key
+        self.preferred_entry_ip = preferred_entry_ip
+        self.failed_entry_ips = frozenset(failed_entry_ips)
+
+    def candidates(self, logical_server):
+        """Physical servers the selection is made from."""
+        candidates = [
+            server for server in logical_server.physical_servers
+            if server.enabled
+        ]
+        for keep in (
+            lambda server: server.entry_ip not in self.failed_entry_ips,
+            lambda server: not server.services_down_reason,
+        ):
+            preferred = [server for server in candidates if keep(server)]
+            if preferred:
+                candidates = preferred
+
+        return candidates
+
+    def select(self, logical_server):
+        """
+        Choose a physical server of logical_server.
+
+        Raises:
+            EmptyServerListError: no physical server is enabled
+        """
+        candidates = self.candidates(logical_server)
+        if not candidates:
+            logger.error("List of physical servers is empty")
+            raise exceptions.EmptyServerListError("No servers could be found")
+
+        for server in candidates:
+            if server.entry_ip == self.preferred_entry_ip:
+                return server
+
+        if self.key is None:
+            return random.choice(candidates)
+
+        return max(candidates, key=self.__score)
+
+    def __score(self, server):
+        digest = hashlib.sha256(
+            "{}|{}".format(self.key, server.entry_ip).encode()
+        ).digest()
+        # Ties (same entry IP) are broken by domain for a stable order
+        return digest, server.domain
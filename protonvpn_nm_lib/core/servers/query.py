@@ -0,0 +1,116 @@
+from ...enums import FeatureEnum
+
+
+class ServerQuery:
+    """
+    Declarative description of a set of servers.
+
+    Unlike a lambda, a ServerList knows how to compile a query into
+    index lookups (name, countries, city, tier, required features) and
+    bitmask passes on the columnar storage (excluded features, enabled),
+    so it never needs to look at servers that can't match.
+
+    Queries are hashable and compare by value, so they can be used as
+    cache keys.
+
+    Example, non secure core servers in Switzerland:
+    sl.filter(ServerQuery(exit_country="CH", secure_core=False))
+    """
+    def __init__(
+        self, name=None, exit_country=None, entry_country=None, city=None,
+        features=(), exclude_features=(), max_tier=None,
+        enabled_only=False, secure_core=None
+    ):
+        features = set(features)
+        exclude_features = set(exclude_features)
+        if secure_core is True:
+            features.add(FeatureEnum.SECURE_CORE)
+        elif secure_core is False:
+            exclude_features.add(FeatureEnum.SECURE_CORE)
+
+        self.name = name.lower() if name is not None else None
+        self.exit_country = exit_country.upper() \
+            if exit_country is not None else None
+        self.entry_country = entry_country.upper() \
+            if entry_country is not None else None
+        self.city = city.lower() if city is not None else None
+        self.features = frozenset(
+            FeatureEnum(f) for f in features if f != FeatureEnum.NORMAL
+        )
+        self.exclude_features = frozenset(
+            FeatureEnum(f) for f in exclude_features if f != FeatureEnum.NORMAL
+        )
+        self.max_tier = max_tier
+        self.enabled_only = bool(enabled_only)
+
+    @property
+    def _key(self):
+        return (
+            self.name, self.exit_country, self.entry_country, self.city,
+            self.features, self.exclude_features, self.max_tier,
+            self.enabled_only
+        )
+
+    def __eq__(self, other):
+        return isinstance(other, ServerQuery) and self._key == other._key
+
+    def __hash__(self):
+        return hash(self._key)
+
+    def __repr__(self):
+        return "ServerQuery<{}>".format(", ".join(
+            "{}={!r}".format(attribute, value)
+            for attribute, value in vars(self).items()
+            if value not in (None, False, frozenset())
+        ))
+
+    @staticmethod
+    def _mask(features):
+        mask = 0
+        for feature in features:
+            mask |= feature
+
+        return mask
+
+    def rows(self, state):
+        """Compile the query against a ServerListState, return the set of rows."""
+        rows = state.indexes.lookup(
+            name=self.name,
+            exit_country=self.exit_country,
+            entry_country=self.entry_country,
+            city=self.city,
+            features=self.features,
+            max_tier=self.max_tier,
+        )
+        if not self.exclude_features and not self.enabled_only:
+            return rows
+
+        return set(state.columns.select(
+            sorted(rows),
+            enabled=self.enabled_only,
+            exclude_features=self._mask(self.exclude_features),
+        ))
+
+    def __call__(self, server):
+        """Evaluate the query on a single LogicalServer."""
+        for attribute in ["exit_country", "entry_country"]:
+            value = getattr(self, attribute)
+            if value is not None and getattr(server, attribute).upper() != value:
+                return False
+
+        for attribute in ["name", "city"]:
+            value = getattr(self, attribute)
+            if value is not None and (getattr(server, attribute) or "").lower() != value:
+                return False
+
+        server_features = server.features
+        if (
+            not self.features.issubset(server_features)
+            or not self.exclude_features.isdisjoint(server_features)
+        ):
+            return False
+
+        if self.max_tier is not None and server.tier > self.max_tier:
+            return False
+
+        return not self.enabled_only or server.enabled
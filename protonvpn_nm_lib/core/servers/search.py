@@ -0,0 +1,174 @@
+import bisect
+import heapq
+import re
+import unicodedata
+
+from ...country_codes import country_codes
+from ...enums import FeatureEnum
+from .cache import LRUCache
+
+# Relevance of a term matching a token of each field, doubled when the
+# term is the whole token rather than a prefix of it
+FIELD_WEIGHTS = {
+    "name": 8,
+    "exit_country": 4,
+    "city": 3,
+    "region": 2,
+    "features": 1,
+}
+FEATURE_KEYWORDS = {
+    FeatureEnum.SECURE_CORE: ("secure", "core", "securecore", "sc"),
+    FeatureEnum.TOR: ("tor",),
+    FeatureEnum.P2P: ("p2p", "torrent"),
+    FeatureEnum.STREAMING: ("streaming",),
+    FeatureEnum.IPv6: ("ipv6",),
+}
+_SEPARATORS = re.compile(r"[\W_]+")
+
+
+def tokenize(text):
+    """
+    Split text in lower-cased tokens, without accents,
+    ie "Zürich, CH#12" -> ["zurich", "ch", "12"].
+    """
+    try:
+        text.encode("ascii")
+    except UnicodeEncodeError:
+        text = "".join(
+            char for char in unicodedata.normalize("NFKD", text)
+            if not unicodedata.combining(char)
+        )
+    text = text.casefold()
+    return [token for token in _SEPARATORS.split(text) if token]
+
+
+class ServerSearchIndex:
+    """
+    Inverted index of the servers of a ServerColumns, for full-text search.
+
+    Server names, exit countries (code and name), cities, regions and
+    feature keywords are split in tokens, each token mapping to the rows
+    having it along with the weight of the best field it appears in.
+
+    Every term of a query matches the tokens it is a prefix of, so that
+    partial input (typeahead) already finds servers. Matches of a term
+    are cached, typing one more character only merges the tokens of the
+    longer prefix.
+
+    The index only depends on the logicals, like ServerIndexes.
+    """
+    def __init__(self, columns):
+        self.__postings = {}
+        for row, name in enumerate(columns.name):
+            self.__add(tokenize(name), (row,), FIELD_WEIGHTS["name"])
+
+        for field in ("exit_country", "city", "region"):
+            column = getattr(columns, field)
+            rows_by_code = {}
+            for row, code in enumerate(column.codes):
+                rows_by_code.setdefault(code, []).append(row)
+
+            for code, rows in rows_by_code.items():
+                value = column.values[code]
+                if value is None:
+                    continue
+                if field == "exit_country":
+                    value = "{} {}".format(value, country_codes.get(value, ""))
+                self.__add(tokenize(value), rows, FIELD_WEIGHTS[field])
+
+        for feature, keywords in FEATURE_KEYWORDS.items():
+            mask = int(feature)
+            rows = [
+                row for row, server_features in enumerate(columns.features)
+                if server_features & mask
+            ]
+            self.__add(keywords, rows, FIELD_WEIGHTS["features"])
+
+        self.__tokens = sorted(self.__postings)
+        self.__matches = LRUCache(maxsize=256)
+
+    def __add(self, tokens, rows, weight):
+        for token in tokens:
+            postings = self.__postings.setdefault(token, {})
+            for row in rows:
+                if postings.get(row, 0) < weight:
+                    postings[row] = weight
+
+    def matches(self, term):
+        """Return {row: relevance} of the rows having a token starting with term."""
+        matches = self.__matches.get(term)
+        if matches is not None:
+            return matches
+
+        start = bisect.bisect_left(self.__tokens, term)
+        # Every token starting with term sorts before term + U+FFFF
+        end = bisect.bisect_left(self.__tokens, term + "\uffff", start)
+        matches = {}
+        for token in self.__tokens[start:end]:
+            bonus = 2 if token == term else 1
+            for row, weight in self.__postings[token].items():
+                relevance = weight * bonus
+                if matches.get(row, 0) < relevance:
+                    matches[row] = relevance
+
+        self.__matches.put(term, matches)
+        return matches
+
+    def search(self, text, limit=None, rows=None, end=None, scores=None):
+        """
+        Get the rows matching every term of text, most relevant first.
+
+        Args:
+            text (str): query, ie "swi p2p" or "CH#1"
+            limit (int): maximum number of rows to return
+            rows (container): only return these rows
+            end (int): only return rows below end (ie tier prefix)
+            scores (sequence): score of each row, lower scores first among
+                rows of equal relevance
+        Returns:
+            list: rows
+        """
+        terms_matches = sorted(
+            (self.matches(term) for term in set(tokenize(text))), key=len
+        )
+        if not terms_matches:
+            return []
+
+        # Start from the term with the fewest matches, so that the cost is
+        # bounded by the number of matching servers
+        relevance = terms_matches[0]
+        if end is not None or rows is not None:
+            relevance = {
+                row: value for row, value in relevance.items()
+                if (end is None or row < end) and (rows is None or row in rows)
+            }
+        for matches in terms_matches[1:]:
+            relevance = {
+                row: value + matches[row]
+                for row, value in relevance.items()
+                if row in matches
+            }
+
+        # There are only a few distinct relevances: group the rows by
+        # relevance, and only order the groups needed to reach limit
+        groups = {}
+        for row, value in relevance.items():
+            groups.setdefault(value, []).append(row)
+
+        result = []
+        for value in sorted(groups, reverse=True):
+            group = groups[value]
+            remaining = None if limit is None else limit - len(result)
+            if remaining is not None and remaining <= 0:
+                break
+            if scores is None:
+                group.sort()
+                result.extend(group[:remaining])
+            elif remaining is None or remaining >= len(group):
+                result.extend(sorted(group, key=scores.__getitem__))
+            else:
+                result.extend(
+                    heapq.nsmallest(remaining, group, key=scores.__getitem__)
+                )
+
+        return result
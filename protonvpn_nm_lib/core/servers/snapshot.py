@@ -0,0 +1,347 @@
+import array
+import json
+import mmap
+import struct
+
+from .columns import ServerColumns
+
+# Binary snapshot of a ServerList, meant to be memory mapped.
+#
+# Layout (little endian):
+# - header: magic, format version, row count, timestamps, section count
+# - section table: name, offset and length of each section
+# - sections, each one aligned on 8 bytes:
+#   - one fixed width array per numeric column, one row per logical
+#   - "<column>" (codes) and "<column>.values" (string table)
+#     for the dictionary encoded string columns
+#   - "id" and "name" string tables, one entry per row
+#   - "id.order" and "name.order", rows sorted by ID and lower-cased name
+#   - "exit_ip", "exit_ip.row" and "exit_ip.domain": sorted exit IPs,
+#     with the row and domain that ServerList.match_server_domain uses
+#   - "records": string table with the compact JSON of each logical
+#   - "tier.partitions": (tier, first row, end row) for each tier, rows
+#     being grouped by tier, so that the servers of the tiers a user
+#     can't use are never read from the mapping
+#
+# A string table is a count (uint32), count + 1 offsets (uint32) and
+# the concatenated UTF-8 strings.
+MAGIC = b"PVSL"
+FORMAT_VERSION = 3
+HEADER = struct.Struct("<4sHHIddI")
+SECTION = struct.Struct("<32sQQ")
+COUNT = struct.Struct("<I")
+STRING_COLUMNS = ("exit_country", "entry_country", "city", "region")
+# Numeric columns are stored with an explicit little endian layout,
+# arrays are converted if the host is big endian
+BYTE_ORDER_IS_LITTLE = array.array("H", [1]).tobytes()[0] == 1
+
+
+class StringTable:
+    """Read-only sequence of strings stored in a string table section."""
+    def __init__(self, buffer):
+        self._count = COUNT.unpack_from(buffer, 0)[0]
+        self._offsets = buffer[COUNT.size:COUNT.size + 4 * (self._count + 1)].cast("I")
+        self._blob = buffer[COUNT.size + 4 * (self._count + 1):]
+
+    @staticmethod
+    def pack(strings):
+        encoded = [(s if s is not None else "").encode("utf-8") for s in strings]
+        offsets = array.array("I", [0])
+        for value in encoded:
+            offsets.append(offsets[-1] + len(value))
+
+        return COUNT.pack(len(encoded)) + _little_endian(offsets) + b"".join(encoded)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self._count
+        if not 0 <= idx < self._count:
+            raise IndexError("String table index out of range")
+
+        return str(self._blob[self._offsets[idx]:self._offsets[idx + 1]], "utf-8")
+
+    def __iter__(self):
+        for idx in range(self._count):
+            yield self[idx]
+
+
+def _little_endian(values):
+    if not BYTE_ORDER_IS_LITTLE:
+        values = array.array(values.typecode, values)
+        values.byteswap()
+
+    return values.tobytes()
+
+
+def _bisect(length, key, value):
+    """bisect_left over a virtual sorted sequence, key(i) being its i-th item."""
+    low, high = 0, length
+    while low < high:
+        middle = (low + high) // 2
+        if key(middle) < value:
+            low = middle + 1
+        else:
+            high = middle
+
+    return low
+
+
+class ServerListSnapshot:
+    """
+    Memory mappable, read-only snapshot of a ServerList.
+
+    Columns are exposed as memoryviews on the underlying buffer and
+    logicals are only decoded (one by one) when accessed, so opening a
+    snapshot does not depend on the number of servers.
+    """
+    def __init__(self, buffer):
+        if isinstance(buffer, bytes):
+            # Columns have to be writable, to apply load updates
+            buffer = bytearray(buffer)
+        self._buffer = memoryview(buffer)
+        (
+            magic, version, _, self.row_count,
+            self.logicals_update_timestamp, self.loads_update_timestamp,
+            section_count
+        ) = HEADER.unpack_from(self._buffer, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("Unsupported server list snapshot format")
+        if not BYTE_ORDER_IS_LITTLE:
+            raise ValueError("Server list snapshots require a little endian host")
+
+        self._sections = {}
+        for idx in range(section_count):
+            name, offset, length = SECTION.unpack_from(
+                self._buffer, HEADER.size + idx * SECTION.size
+            )
+            self._sections[name.rstrip(b"\0").decode("ascii")] = \
+                self._buffer[offset:offset + length]
+
+        self.ids = self.strings("id")
+        self.names = self.strings("name")
+        self._records = self.strings("records")
+        self._id_order = self.column("id.order", "I")
+        self._name_order = self.column("name.order", "I")
+        self._exit_ips = self.strings("exit_ip")
+        self._exit_ip_rows = self.column("exit_ip.row", "I")
+        self._exit_ip_domains = self.strings("exit_ip.domain")
+
+    @classmethod
+    def open(cls, path):
+        """
+        Memory map a snapshot file.
+
+        The mapping is private (copy on write): in-process updates of
+        the columns (ie loads) are possible but never written back.
+        """
+        with open(path, "rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
+
+    def column(self, name, typecode):
+        return self._sections[name].cast(typecode)
+
+    def strings(self, name):
+        return StringTable(self._sections[name])
+
+    def tier_partitions(self):
+        """Return {tier: range of the rows of that tier}."""
+        partitions = self.column("tier.partitions", "I")
+        return {
+            partitions[idx]: range(partitions[idx + 1], partitions[idx + 2])
+            for idx in range(0, len(partitions), 3)
+        }
+
+    def logical(self, row):
+        """Decode the logical of a row."""
+        return json.loads(self._records[row])
+
+    def row_by_id(self, logical_id):
+        idx = _bisect(
+            self.row_count, lambda i: self.ids[self._id_order[i]], logical_id
+        )
+        if idx < self.row_count and self.ids[self._id_order[idx]] == logical_id:
+            return self._id_order[idx]
+
+        return None
+
+    def _name_at(self, idx):
+        return self.names[self._name_order[idx]].lower()
+
+    def row_by_name(self, name):
+        name = name.lower()
+        idx = _bisect(self.row_count, self._name_at, name)
+        if idx < self.row_count and self._name_at(idx) == name:
+            return self._name_order[idx]
+
+        return None
+
+    def names_with_prefix(self, prefix):
+        """Return the (lower-cased) names starting with prefix, sorted."""
+        prefix = prefix.lower()
+        start = _bisect(self.row_count, self._name_at, prefix)
+        end = _bisect(self.row_count, self._name_at, prefix + "\uffff")
+        return [self._name_at(idx) for idx in range(start, end)]
+
+    def exit_ip(self, ip):
+        """Return (row, domain) for the exit IP, or None."""
+        count = len(self._exit_ips)
+        idx = _bisect(count, self._exit_ips.__getitem__, ip)
+        if idx < count and self._exit_ips[idx] == ip:
+            return self._exit_ip_rows[idx], self._exit_ip_domains[idx]
+
+        return None
+
+    def exit_ip_items(self):
+        """Iterate over (exit IP, (row, domain)), sorted by IP."""
+        for idx, ip in enumerate(self._exit_ips):
+            yield ip, (self._exit_ip_rows[idx], self._exit_ip_domains[idx])
+
+    def record(self, row):
+        """Return the compact JSON of the logical of a row."""
+        return self._records[row]
+
+    @staticmethod
+    def dumps(data, columns, indexes):
+        """
+        Serialize a toplevel ServerList content.
+
+        Args:
+            data (dict): ServerList data (with LogicalServers)
+            columns (ServerColumns)
+            indexes (ServerIndexes)
+        Returns:
+            bytes
+        """
+        logicals = data["LogicalServers"]
+        sections = []
+
+        for name, typecode in ServerColumns.NUMERIC_COLUMNS.items():
+            sections.append(
+                (name, _little_endian(array.array(typecode, getattr(columns, name))))
+            )
+
+        for name in STRING_COLUMNS:
+            column = getattr(columns, name)
+            sections.append((name, _little_endian(array.array("H", column.codes))))
+            sections.append((name + ".values", StringTable.pack(column.values)))
+
+        sections.append(("id", StringTable.pack(columns.id)))
+        sections.append(("name", StringTable.pack(columns.name)))
+        sections.append(("id.order", _little_endian(array.array(
+            "I", sorted(range(len(columns)), key=columns.id.__getitem__)
+        ))))
+        sections.append(("name.order", _little_endian(array.array(
+            "I", sorted(
+                range(len(columns)), key=lambda row: columns.name[row].lower()
+            )
+        ))))
+
+        exit_ips = sorted(indexes.exit_ip.items())
+        sections.append(("exit_ip", StringTable.pack(ip for ip, _ in exit_ips)))
+        sections.append(("exit_ip.row", _little_endian(array.array(
+            "I", [row for _, (row, _) in exit_ips]
+        ))))
+        sections.append(("exit_ip.domain", StringTable.pack(
+            domain for _, (_, domain) in exit_ips
+        )))
+
+        if isinstance(logicals, LazyLogicals):
+            records = (logicals.record(row) for row in range(len(logicals)))
+        else:
+            records = (
+                json.dumps(logical, separators=(",", ":"))
+                for logical in logicals
+            )
+        sections.append(("records", StringTable.pack(records)))
+        sections.append(("tier.partitions", _little_endian(array.array("I", [
+            value
+            for tier, rows in sorted(columns.tier_partitions().items())
+            for value in (tier, rows.start, rows.stop)
+        ]))))
+
+        offset = HEADER.size + SECTION.size * len(sections)
+        table = []
+        body = []
+        for name, content in sections:
+            padding = -offset % 8
+            body.append(b"\0" * padding)
+            offset += padding
+            table.append(SECTION.pack(name.encode("ascii"), offset, len(content)))
+            body.append(content)
+            offset += len(content)
+
+        header = HEADER.pack(
+            MAGIC, FORMAT_VERSION, 0, len(columns),
+            data.get("LogicalsUpdateTimestamp", 0.),
+            data.get("LoadsUpdateTimestamp", 0.),
+            len(sections)
+        )
+        return header + b"".join(table) + b"".join(body)
+
+
+class LazyLogicals:
+    """
+    Sequence of the logicals of a snapshot, decoded on first access.
+
+    Decoded logicals are kept, so that they can be updated in place like
+    the ones of a JSON loaded list. Loads, scores and statuses are taken
+    from the columns, which are more recent than the records once load
+    updates have been applied.
+    """
+    def __init__(self, snapshot, columns):
+        self._snapshot = snapshot
+        self._columns = columns
+        # Decoded logicals, by row
+        self._logicals = {}
+
+    def copy(self, columns):
+        """Copy, sharing the decoded logicals, with other (load) columns."""
+        logicals = self.__class__(self._snapshot, columns)
+        logicals._logicals = dict(self._logicals)
+        return logicals
+
+    def loaded(self, row):
+        """Return the logical of row if it was already decoded, else None."""
+        return self._logicals.get(row)
+
+    def record(self, row):
+        """
+        Return the compact JSON of a logical.
+
+        Records of logicals that were never decoded are copied as is,
+        their loads are outdated but the columns are the reference.
+        """
+        logical = self._logicals.get(row)
+        if logical is None:
+            return self._snapshot.record(row)
+
+        return json.dumps(logical, separators=(",", ":"))
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError("Logical server index out of range")
+
+        logical = self._logicals.get(row)
+        if logical is None:
+            logical = self._snapshot.logical(row)
+            logical["Load"] = self._columns.load[row]
+            logical["Score"] = self._columns.score[row]
+            logical["Status"] = self._columns.status[row]
+            self._logicals[row] = logical
+
+        return logical
+
+    def __setitem__(self, row, logical):
+        self._logicals[row] = logical
+
+    def __len__(self):
+        return self._snapshot.row_count
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
@@ -0,0 +1,146 @@
+import email.utils
+import random
+import threading
+import time
+
+from ...exceptions import API429Error, API503Error
+from ...logger import logger
+
+
+class RequestBackoff:
+    """
+    Backoff and circuit breaker for API requests, per endpoint.
+
+    When an endpoint answers 429 (too many requests) or 503 (unavailable),
+    its circuit opens: requests to it fail right away, without reaching
+    the API, until the time given by Retry-After, or otherwise until a
+    jittered exponential backoff elapsed. Once that time has passed, a
+    single request is let through: the circuit closes if the API answers
+    it, and opens again, for longer, if the API still refuses it.
+
+    Nothing sleeps here: callers get an error right away (and keep using
+    their cached data), and retry_in() tells when requesting again makes
+    sense, so that retries can be scheduled.
+    """
+    ERRORS = {429: API429Error, 503: API503Error}
+    # Backoff without Retry-After: between half and all of
+    # BASE_DELAY * 2^(failures - 1), up to MAX_DELAY
+    BASE_DELAY = 10
+    MAX_DELAY = 30 * 60
+    # Retry-After is honoured, up to
+    MAX_RETRY_AFTER = 6 * 60 * 60
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        # {path: _CircuitState}, for the endpoints with open circuits
+        self.__states = {}
+
+    def check(self, path):
+        """
+        Make sure path can be requested, before requesting it.
+
+        Raises:
+            API429Error, API503Error: the circuit of path is open (with the
+                error that opened it), or its first request since the
+                backoff elapsed is still running
+        """
+        with self.__lock:
+            state = self.__states.get(path)
+            if state is None:
+                return
+
+            retry_in = state.retry_at - time.time()
+            if retry_in <= 0 and not state.probing:
+                state.probing = True
+                return
+
+        raise self.ERRORS[state.code](
+            "Requests to {} are held back for {:.0f} more seconds".format(
+                path, max(retry_in, 0)
+            )
+        )
+
+    def success(self, path):
+        """The API answered a request to path: close its circuit."""
+        with self.__lock:
+            if self.__states.pop(path, None) is not None:
+                logger.info("Requests to {} are no longer held back".format(path))
+
+    def failure(self, path, error):
+        """
+        A request to path failed with ProtonAPIError error.
+
+        Only 429 and 503 open the circuit, other errors are answers of
+        the API and close it.
+        """
+        if error.code not in self.ERRORS:
+            self.success(path)
+            return
+
+        with self.__lock:
+            state = self.__states.setdefault(path, _CircuitState())
+            state.failures += 1
+            state.code = error.code
+            state.probing = False
+
+            delay = self.__retry_after(error)
+            if delay is None:
+                delay = min(
+                    self.MAX_DELAY, self.BASE_DELAY * 2 ** (state.failures - 1)
+                )
+                delay = delay / 2 + random.random() * delay / 2
+            state.retry_at = time.time() + delay
+
+        logger.info("Holding back requests to {} for {:.0f} seconds".format(
+            path, delay
+        ))
+
+    def release(self, path):
+        """A request to path got no answer (ie network error)."""
+        with self.__lock:
+            state = self.__states.get(path)
+            if state is not None:
+                state.probing = False
+
+    def retry_in(self, path=None):
+        """
+        Seconds until path (or the first held back endpoint, without path)
+        can be requested again, None if it is not held back.
+        """
+        with self.__lock:
+            if path is not None:
+                states = [self.__states[path]] if path in self.__states else []
+            else:
+                states = list(self.__states.values())
+
+        if not states:
+            return None
+
+        return max(min(state.retry_at for state in states) - time.time(), 0)
+
+    def __retry_after(self, error):
+        headers = getattr(error, "headers", None) or {}
+        value = headers.get("Retry-After")
+        if value is None:
+            return None
+
+        # Either seconds or an HTTP date
+        try:
+            delay = float(value)
+        except ValueError:
+            try:
+                delay = email.utils.parsedate_to_datetime(value).timestamp() \
+                    - time.time()
+            except (TypeError, ValueError):
+                return None
+
+        return min(max(delay, 0), self.MAX_RETRY_AFTER)
+
+
+class _CircuitState:
+    def __init__(self):
+        self.failures = 0
+        self.code = None
+        self.retry_at = 0
+        # Whether the request let through once retry_at passed is running
+        self.probing = False
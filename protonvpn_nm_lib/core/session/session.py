@@ -1,22 +1,33 @@
+import contextlib
+import fcntl
+import json
 import os
 import random
+import tempfile
+import threading
 import time
+from urllib.parse import urlparse
 
 from ...constants import (API_METADATA_FILEPATH, API_URL, APP_VERSION,
-                          CACHED_SERVERLIST, CLIENT_CONFIG,
+                          CACHE_LOCK, CACHE_VALIDATORS, CACHED_SERVERLIST,
+                          CACHED_SERVERLIST_JOURNAL,
+                          CACHED_SERVERLIST_SNAPSHOT, CLIENT_CONFIG,
                           CONNECTION_STATE_FILEPATH,
                           LAST_CONNECTION_METADATA_FILEPATH,
                           PROTON_XDG_CACHE_HOME, PROTON_XDG_CACHE_HOME_LOGS,
                           STREAMING_ICONS_CACHE_TIME_PATH, STREAMING_SERVICES)
 from ...enums import KeyringEnum, KillswitchStatusEnum, UserSettingStatusEnum
-from ...exceptions import (API403Error, API5002Error, API5003Error,
-                           API8002Error, API9001Error, API10013Error,
+from ...exceptions import (API403Error, API429Error, API503Error,
+                           API5002Error, API5003Error, API8002Error,
+                           API9001Error, API10013Error,
                            APISessionIsNotValidError, APITimeoutError,
                            DefaultOVPNPortsNotFoundError, InsecureConnection,
                            JSONDataError, NetworkConnectionError,
-                           UnknownAPIError, UnreacheableAPIError)
+                           ProtonVPNException, UnknownAPIError,
+                           UnreacheableAPIError)
 from ...logger import logger
 from ..environment import ExecutionEnvironment
+from .backoff import RequestBackoff
 
 
 class ErrorStrategy:
@@ -33,7 +44,7 @@ class ErrorStrategy:
             result = self._func(session, *args, **kwargs)
         except ProtonAPIError as e:
             logger.exception(e)
-            self.__handle_api_error(e, session, *args, **kwargs)
+            result = self.__handle_api_error(e, session, *args, **kwargs)
         except ConnectionTimeOutError as e:
             logger.exception(e)
             raise APITimeoutError("Connection to API timed out")
@@ -80,33 +91,16 @@ class ErrorStrategy:
     def _call_with_error_remapping(self, session, *args, **kwargs):
         return self._func(session, *args, **kwargs)
 
-    def _call_original_function(self, session, *args, **kwargs):
-        return getattr(session, self.__func__.__name__)(*args, **kwargs)
-
-    # Common handlers retries
+    # Requests are not retried here, as that would block the calling
+    # thread: APISession holds back the endpoint (see RequestBackoff)
+    # and schedules cache refreshes for when it can be requested again
     def _handle_429(self, error, session, *args, **kwargs):
-        logger.info("Catched 429 error, will retry")
-
-        hold_request_time = error.headers["Retry-After"]
-        try:
-            hold_request_time = int(hold_request_time)
-        except ValueError:
-            # Wait at least two seconds, and up to 20
-            hold_request_time = 2 + random.random() * 18
-
-        logger.info("Retrying after {} seconds".format(hold_request_time))
-        time.sleep(hold_request_time)
-
-        # Retry
-        return self._call_original_function(session, *args, **kwargs)
+        logger.info("Catched 429 error, raising too many requests exception")
+        raise API429Error(error)
 
     def _handle_503(self, error, session, *args, **kwargs):
-        logger.info("Catched 503 error, retrying new request")
-
-        # Wait between 2 and 10 seconds
-        hold_request_time = 2 + random.random() * 8
-        time.sleep(hold_request_time)
-        return self._call_original_function(session, *args, **kwargs)
+        logger.info("Catched 503 error, raising unavailable API exception")
+        raise API503Error(error)
 
     def _handle_9001(self, error, session, *args, **kwargs):
         logger.info("Catched 9001 error, raising human verification exception")
@@ -182,6 +176,18 @@ class APISession:
     STREAMING_ICON_TIME_EXPIRE = 480 * 60  # 480min in seconds
     LOADS_CACHE_TIME_EXPIRE = 15 * 60  # 15min in seconds
     RANDOM_FRACTION = 0.22  # Generate a value of the timeout, +/- up to 22%, at random
+    # Expired caches are returned right away and refreshed in the
+    # background, unless they are older than this (or empty)
+    CACHE_MAX_STALENESS = 24 * 60 * 60  # 24h in seconds
+    BACKGROUND_REFRESH = True
+    # Responses to these requests are validated with ETag/Last-Modified,
+    # and requested again with If-None-Match/If-Modified-Since
+    CONDITIONAL_REQUESTS = (
+        "/vpn/logicals", "/vpn/clientconfig", "/vpn/streamingservices"
+    )
+    # Seconds to wait for another process refreshing the caches, about
+    # the API timeout (connect + read), before refreshing them anyway
+    CACHE_LOCK_TIMEOUT = 40
 
     def __init__(self, api_url=None, enforce_pinning=True):
         if api_url is None:
@@ -198,6 +204,29 @@ class APISession:
         self.__streaming_services = None
         self.__streaming_icons = None
 
+        # Held while caches are fetched and updated, along with
+        # CACHE_LOCK for other processes (see __cache_lock)
+        self.__refresh_lock = threading.RLock()
+        self.__cache_lock_file = None
+        self.__cache_lock_depth = 0
+        # {filepath: mtime} of the cache files when they were last read
+        # or written by this session
+        self.__cache_mtimes = {}
+        self.__background_refresh = None
+        self.__background_refresh_lock = threading.Lock()
+        # Changed by logout, so that refreshes started before it
+        # don't store the caches of the previous user
+        self.__cache_generation = 0
+        # Refresh scheduled for when held back requests can be retried
+        self.__scheduled_refresh = None
+        self.__scheduled_refresh_at = None
+        self.__backoff = RequestBackoff()
+
+        # {path: {"ETag": ..., "Last-Modified": ..., "ValidatedTimestamp": ...}}
+        self.__validators = None
+        # Validators of the last response to each conditional request
+        self.__response_validators = {}
+
         # Load session
         try:
             self.__keyring_load_session()
@@ -219,6 +248,30 @@ class APISession:
         )
         self.__proton_api.enable_alternative_routing = ExecutionEnvironment()\
             .settings.alternative_routing.value
+        self.__add_validators_hook()
+
+    def __add_validators_hook(self):
+        # api_request() only returns the content of responses, their
+        # validators are collected from the underlying requests session
+        requests_session = getattr(self.__proton_api, "s", None)
+        if requests_session is not None:
+            requests_session.hooks["response"].append(
+                self.__collect_validators
+            )
+
+    def __collect_validators(self, response, *args, **kwargs):
+        if response.status_code != 200:
+            return
+
+        path = urlparse(response.url).path
+        for request_path in self.CONDITIONAL_REQUESTS:
+            # The path is prefixed when using alternative routing
+            if path.endswith(request_path):
+                self.__response_validators[request_path] = {
+                    header: response.headers[header]
+                    for header in ("ETag", "Last-Modified")
+                    if header in response.headers
+                }
 
     def update_alternative_routing(self, newvalue):
         self.__proton_api.enable_alternative_routing = newvalue
@@ -285,6 +338,7 @@ class APISession:
         )
         self.__proton_api.enable_alternative_routing = ExecutionEnvironment()\
             .settings.alternative_routing.value
+        self.__add_validators_hook()
         self.__proton_user = keyring_data_user['proton_username']
 
     def __keyring_clear_session(self):
@@ -314,8 +368,18 @@ class APISession:
         self.__proton_user = None
         self.__vpn_data = None
 
-        self.__vpn_logicals = None
-        logger.info("Cleared local cache variables")
+        # A refresh running in the background drops its responses once
+        # it sees the new generation, and is waited for before clearing
+        # the caches, so that it doesn't write them back
+        self.__cache_generation += 1
+        with self.__background_refresh_lock:
+            if self.__scheduled_refresh is not None:
+                self.__scheduled_refresh.cancel()
+                self.__scheduled_refresh = None
+                self.__scheduled_refresh_at = None
+
+        with self.__refresh_lock:
+            self.__clear_caches()
 
         # A best effort is to logout the user via
         # the API, but if that is not possible then
@@ -327,20 +391,32 @@ class APISession:
             logger.info("Unable to logout via API")
             pass
 
+        # Re-create a new
+        self.__session_create()
+
+        return True
+
+    def __clear_caches(self):
+        self.__vpn_logicals = None
+        self.__clientconfig = None
+        self.__streaming_services = None
+        self.__streaming_icons = None
+        self.__validators = None
+        self.__response_validators = {}
+        self.__cache_mtimes = {}
+        logger.info("Cleared local cache variables")
+
         logger.info("Remove cache files")
         filepaths_to_remove = [
-            CACHED_SERVERLIST, CLIENT_CONFIG, API_METADATA_FILEPATH,
+            CACHED_SERVERLIST, CACHED_SERVERLIST_SNAPSHOT,
+            CACHED_SERVERLIST_JOURNAL, CLIENT_CONFIG, API_METADATA_FILEPATH,
             LAST_CONNECTION_METADATA_FILEPATH, CONNECTION_STATE_FILEPATH,
-            STREAMING_ICONS_CACHE_TIME_PATH, STREAMING_SERVICES
+            STREAMING_ICONS_CACHE_TIME_PATH, STREAMING_SERVICES,
+            CACHE_VALIDATORS
         ]
         for fp in filepaths_to_remove:
             self.remove_cache(fp)
 
-        # Re-create a new
-        self.__session_create()
-
-        return True
-
     @ErrorStrategyRefresh
     def refresh(self):
         self.ensure_valid()
@@ -381,12 +457,12 @@ class APISession:
 
         self.__proton_user = username
 
-        # just by calling the properties, it automatically triggers to cache the data
-        _ = [
-            self.servers, self.clientconfig,
-            self.streaming, self.streaming_icons,
-            self._vpn_data
-        ]
+        # Cache the data, the API requests are made concurrently
+        try:
+            self.refresh_all_if_needed()
+        except: # noqa
+            pass
+        self._vpn_data
 
         return True
 
@@ -422,7 +498,7 @@ class APISession:
     def __vpn_data_fetch_from_api(self):
         self.ensure_valid()
 
-        api_vpn_data = self.__proton_api.api_request('/vpn')
+        api_vpn_data = self.__request('/vpn')
         self.__vpn_data = {
             'username': api_vpn_data['VPN']['Name'],
             'password': api_vpn_data['VPN']['Password'],
@@ -468,39 +544,224 @@ class APISession:
     def vpn_tier(self):
         return self._vpn_data['tier']
 
-    def __generate_random_component(self):
-        # 1 +/- 0.22*random
-        return (1 + self.RANDOM_FRACTION * (2 * random.random() - 1))
+    def __generate_random_component(self, name, timestamp):
+        # 1 +/- 0.22*random, the random value being derived from the
+        # timestamp of the cache: every process sharing the cache files
+        # computes the same deadline, while the deadlines of different
+        # hosts are still spread
+        rng = random.Random("{}:{}".format(name, timestamp))
+        return (1 + self.RANDOM_FRACTION * (2 * rng.random() - 1))
+
+    def __next_fetch(self, name, timestamp, expire):
+        return timestamp + expire * self.__generate_random_component(
+            name, timestamp
+        )
 
     def _update_next_fetch_logicals(self):
-        self.__next_fetch_logicals = self \
-            .__vpn_logicals.logicals_update_timestamp + \
-            self.FULL_CACHE_TIME_EXPIRE * self.__generate_random_component()
+        self.__next_fetch_logicals = self.__next_fetch(
+            "logicals", self.__cache_timestamp("/vpn/logicals"),
+            self.FULL_CACHE_TIME_EXPIRE
+        )
 
     def _update_next_fetch_loads(self):
-        self.__next_fetch_load = self \
-            .__vpn_logicals.loads_update_timestamp + \
-            self.LOADS_CACHE_TIME_EXPIRE * self.__generate_random_component()
+        self.__next_fetch_load = self.__next_fetch(
+            "loads", self.__vpn_logicals.loads_update_timestamp,
+            self.LOADS_CACHE_TIME_EXPIRE
+        )
 
     def _update_next_fetch_client_config(self):
-        self.__next_fetch_client_config = self \
-            .__clientconfig.client_config_timestamp + \
-            self.CLIENT_CONFIG_TIME_EXPIRE * self.__generate_random_component()
+        self.__next_fetch_client_config = self.__next_fetch(
+            "clientconfig", self.__cache_timestamp("/vpn/clientconfig"),
+            self.CLIENT_CONFIG_TIME_EXPIRE
+        )
 
     def _update_next_fetch_streaming_services(self):
-        self.__next_fetch_streaming_service = self \
-            .__streaming_services.streaming_services_timestamp + \
-            self.STREAMING_SERVICES_TIME_EXPIRE * self.__generate_random_component()
+        self.__next_fetch_streaming_service = self.__next_fetch(
+            "streamingservices",
+            self.__cache_timestamp("/vpn/streamingservices"),
+            self.STREAMING_SERVICES_TIME_EXPIRE
+        )
 
     def _update_next_fetch_streaming_icons(self):
-        self.__next_fetch_streaming_icons = self \
-            .__streaming_icons.streaming_icons_timestamp + \
-            self.STREAMING_ICON_TIME_EXPIRE * self.__generate_random_component()
+        self.__next_fetch_streaming_icons = self.__next_fetch(
+            "streamingicons", self.__streaming_icons.streaming_icons_timestamp,
+            self.STREAMING_ICON_TIME_EXPIRE
+        )
+
+    def __content_timestamp(self, path):
+        """Return when the cached response to path was fetched, 0 if none."""
+        if path == "/vpn/logicals":
+            return self.__vpn_logicals.logicals_update_timestamp
+        elif path == "/vpn/clientconfig":
+            return self.__clientconfig.client_config_timestamp
+
+        return self.__streaming_services.streaming_services_timestamp
+
+    def __cache_timestamp(self, path):
+        """Return when the cached response to path was last known to be
+        up to date: when it was fetched, or validated (304) since."""
+        timestamp = self.__content_timestamp(path)
+        if not timestamp:
+            return timestamp
+
+        return max(
+            timestamp,
+            self.__content_validators(path).get("ValidatedTimestamp", 0.)
+        )
+
+    def __content_validators(self, path):
+        """Return the validators of the cached response to path.
+
+        Validators are stored along with the timestamp of the content
+        they were received with, so that they are ignored if the cache was
+        loaded from elsewhere (ie an older cache file): that content can't
+        be validated with them.
+        """
+        validators = self.__cache_validators().get(path, {})
+        if validators.get("ContentTimestamp") != self.__content_timestamp(path):
+            return {}
+
+        return validators
+
+    def __cache_validators(self):
+        if self.__validators is None:
+            self.__cache_mtimes[CACHE_VALIDATORS] = self.__mtime(
+                CACHE_VALIDATORS
+            )
+            try:
+                with open(CACHE_VALIDATORS, "r") as f:
+                    self.__validators = json.load(f)
+            except (OSError, ValueError):
+                # Requests are just not conditional
+                self.__validators = {}
+
+        return self.__validators
+
+    def __update_cache_validators(self, path, modified):
+        """Store the validators of the response to path.
+
+        Args:
+            modified (bool): False if the response was a 304, so only
+                the validation time changes
+        """
+        validators = self.__cache_validators()
+        if modified:
+            validators[path] = self.__response_validators.pop(path, {})
+            validators[path]["ContentTimestamp"] = self.__content_timestamp(
+                path
+            )
+        elif not self.__content_validators(path):
+            return
+
+        validators[path]["ValidatedTimestamp"] = time.time()
+        try:
+            self.__write_cache(CACHE_VALIDATORS, json.dumps(validators))
+        except Exception as e:
+            # This is not fatal, requests will just not be conditional
+            logger.info("Could not save cache validators {}".format(e))
+
+    def __request(self, path, headers=None):
+        """Request path, unless requests to it are held back.
+
+        Raises:
+            API429Error, API503Error: path is held back (see RequestBackoff)
+        """
+        from proton.exceptions import ProtonAPIError
+
+        self.__backoff.check(path)
+        try:
+            response = self.__proton_api.api_request(
+                path, additional_headers=headers
+            )
+        except ProtonAPIError as e:
+            self.__backoff.failure(path, e)
+            raise
+        except: # noqa
+            self.__backoff.release(path)
+            raise
+
+        self.__backoff.success(path)
+        return response
+
+    def __api_request(self, path, force=False):
+        """Request path to update its cache, conditionally if the cached
+        response has validators (unless forced).
+
+        If the API asks to hold back (or path already is), a refresh of
+        the caches is scheduled for when it can be requested again.
+
+        Returns:
+            dict: response, or None if the cached one is still valid
+        """
+        from proton.exceptions import ProtonAPIError
+
+        headers = {}
+        if (
+            path in self.CONDITIONAL_REQUESTS
+            and self.__content_timestamp(path)
+            and not force
+        ):
+            validators = self.__content_validators(path)
+            if "ETag" in validators:
+                headers["If-None-Match"] = validators["ETag"]
+            if "Last-Modified" in validators:
+                headers["If-Modified-Since"] = validators["Last-Modified"]
+
+        try:
+            return self.__request(path, headers or None)
+        except ProtonAPIError as e:
+            # A 304 has no content, so it is reported as an error
+            if e.code == 304 and headers:
+                logger.info("{} was not modified".format(path))
+                return None
+            self.__schedule_refresh(self.__backoff.retry_in(path))
+            raise
+        except (API429Error, API503Error):
+            self.__schedule_refresh(self.__backoff.retry_in(path))
+            raise
+
+    def __servers_request(self, force=False):
+        """Return the path to fetch to update the servers, or None."""
+        if self.__next_fetch_logicals < time.time() or force:
+            return "/vpn/logicals"
+        elif self.__next_fetch_load < time.time():
+            return "/vpn/loads"
+
+        return None
+
+    def __commit_servers(self, path, data):
+        logicals_changed = path == "/vpn/logicals"
+        if data is None:
+            # Not modified, only the logicals were validated
+            self.__update_cache_validators(path, modified=False)
+            self._update_next_fetch_logicals()
+            return
+        elif logicals_changed:
+            self.__vpn_logicals.update_logical_data(data)
+            self.__update_cache_validators(path, modified=True)
+        else:
+            self.__vpn_logicals.update_load_data(data)
+
+        self._update_next_fetch_logicals()
+        self._update_next_fetch_loads()
+
+        try:
+            if (
+                logicals_changed
+                or not os.path.isfile(CACHED_SERVERLIST_SNAPSHOT)
+            ):
+                self.__write_servers_snapshot()
+            else:
+                self.__append_servers_journal()
+        except Exception as e:
+            # This is not fatal, we only were not capable
+            # of storing the cache.
+            logger.info(
+                "Could not save server cache {}".format(e)
+            )
 
     @ErrorStrategyNormalCall
     def update_servers_if_needed(self, force=False):
-        changed = False
-
         if (
             ExecutionEnvironment().settings.killswitch
             == KillswitchStatusEnum.HARD
@@ -508,67 +769,304 @@ class APISession:
         ):
             return
 
-        if self.__next_fetch_logicals < time.time() or force:
-            # Update logicals
-            logger.info("Fetching logicals")
-            self.__ensure_that_alt_routing_can_be_skipped()
-            self.__vpn_logicals.update_logical_data(self.__proton_api.api_request('/vpn/logicals'))
-            changed = True
-        elif self.__next_fetch_load < time.time():
-            # Update loads
-            logger.info("Fetching loads")
-            self.__ensure_that_alt_routing_can_be_skipped()
-            self.__vpn_logicals.update_load_data(self.__proton_api.api_request('/vpn/loads'))
-            changed = True
+        with self.__cache_lock():
+            path = self.__servers_request(force)
+            if path is not None:
+                # Update logicals, or only loads
+                logger.info("Fetching {}".format(path))
+                self.__ensure_that_alt_routing_can_be_skipped()
+                data = self.__api_request(path, force)
+                self.__commit_servers(path, data)
+                self.__update_loads_if_not_modified(path, data)
 
-        if changed:
-            self._update_next_fetch_logicals()
-            self._update_next_fetch_loads()
+        return True
 
-            try:
-                with open(CACHED_SERVERLIST, "w") as f:
-                    f.write(self.__vpn_logicals.json_dumps())
-            except Exception as e:
-                # This is not fatal, we only were not capable
-                # of storing the cache.
-                logger.info(
-                    "Could not save server cache {}".format(e)
+    def __update_loads_if_not_modified(self, path, data):
+        """Fetch the loads, if due, after a 304 to /vpn/logicals: unlike
+        a full response, it doesn't bring up to date loads."""
+        if path == "/vpn/logicals" and data is None:
+            if self.__servers_request() == "/vpn/loads":
+                logger.info("Fetching /vpn/loads")
+                self.__commit_servers(
+                    "/vpn/loads", self.__api_request("/vpn/loads")
                 )
 
-        return True
+    @contextlib.contextmanager
+    def __cache_lock(self):
+        """Hold the lock to fetch and update the caches.
 
-    @property
-    def servers(self):
-        if self.__vpn_logicals is None:
-            from ..servers import ServerList
+        Other threads of this process wait on __refresh_lock, other
+        processes (ie CLI, GUI and daemon) wait on CACHE_LOCK. Once the
+        lock is acquired, the caches written by another process while
+        waiting for it are reloaded, so that their requests are no longer
+        due: only one process makes them.
+        """
+        with self.__refresh_lock:
+            if self.__cache_lock_depth == 0:
+                try:
+                    os.makedirs(os.path.dirname(CACHE_LOCK), exist_ok=True)
+                    self.__cache_lock_file = open(CACHE_LOCK, "a")
+                    self.__lock_file(self.__cache_lock_file)
+                except OSError as e:
+                    # Refresh anyway, other processes are just not waited for
+                    logger.info("Could not lock caches {}".format(e))
+                    if self.__cache_lock_file is not None:
+                        self.__cache_lock_file.close()
+                        self.__cache_lock_file = None
+
+                self.__reload_changed_caches()
+
+            self.__cache_lock_depth += 1
+            try:
+                yield
+            finally:
+                self.__cache_lock_depth -= 1
+                if (
+                    self.__cache_lock_depth == 0
+                    and self.__cache_lock_file is not None
+                ):
+                    # Closing the file releases the lock
+                    self.__cache_lock_file.close()
+                    self.__cache_lock_file = None
+
+    def __lock_file(self, f):
+        # A process holding the lock might be stopped or hung:
+        # only wait for it up to CACHE_LOCK_TIMEOUT
+        deadline = time.time() + self.CACHE_LOCK_TIMEOUT
+        while True:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                if time.time() >= deadline:
+                    raise TimeoutError(
+                        "Caches are locked by another process"
+                    )
+                time.sleep(0.1)
+
+    @staticmethod
+    def __mtime(filepath):
+        try:
+            return os.stat(filepath).st_mtime_ns
+        except OSError:
+            return None
+
+    def __cache_changed(self, *filepaths):
+        return any(
+            self.__mtime(filepath) != self.__cache_mtimes.get(filepath)
+            for filepath in filepaths
+        )
+
+    def __reload_changed_caches(self):
+        """Reload the caches that were written by another process.
 
-            # Create a new server list
+        Next-fetch deadlines are computed again from the reloaded
+        timestamps and validators, so that the requests made by the other
+        process (including those answered with a 304) are no longer due.
+        """
+        # Deadlines depend on the validators, so they are reloaded first
+        if self.__validators is not None and self.__cache_changed(
+            CACHE_VALIDATORS
+        ):
+            self.__validators = None
+            if self.__vpn_logicals is not None:
+                self._update_next_fetch_logicals()
+            if self.__clientconfig is not None:
+                self._update_next_fetch_client_config()
+            if self.__streaming_services is not None:
+                self._update_next_fetch_streaming_services()
+        if self.__vpn_logicals is not None and self.__cache_changed(
+            CACHED_SERVERLIST_SNAPSHOT, CACHED_SERVERLIST_JOURNAL
+        ):
+            logger.info("Reloading server cache")
+            self.__load_servers()
+        if self.__clientconfig is not None and self.__cache_changed(
+            CLIENT_CONFIG
+        ):
+            logger.info("Reloading client config cache")
+            self.__load_client_config()
+        if self.__streaming_services is not None and self.__cache_changed(
+            STREAMING_SERVICES
+        ):
+            logger.info("Reloading streaming cache")
+            self.__load_streaming()
+        if self.__streaming_icons is not None and self.__cache_changed(
+            STREAMING_ICONS_CACHE_TIME_PATH
+        ):
+            self.__load_streaming_icons()
+
+    def __write_cache(self, filepath, content):
+        # Caches are shared with other processes, and can be written by a
+        # background refresh, which might be interrupted when the process
+        # exits: write a new file and replace the cache with it, so that
+        # it is never seen partially written (even after a crash).
+        # The temporary file is unique, as the caches might be written
+        # without holding CACHE_LOCK.
+        fd, tmp_filepath = tempfile.mkstemp(
+            prefix=os.path.basename(filepath) + ".",
+            suffix=".tmp",
+            dir=os.path.dirname(filepath)
+        )
+        try:
+            with os.fdopen(
+                fd, "wb" if isinstance(content, bytes) else "w"
+            ) as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_filepath, filepath)
+        except: # noqa
+            self.remove_cache(tmp_filepath)
+            raise
+        self.__fsync_directory(filepath)
+        self.__cache_mtimes[filepath] = self.__mtime(filepath)
+
+    @staticmethod
+    def __fsync_directory(filepath):
+        # Make the rename itself durable
+        try:
+            fd = os.open(os.path.dirname(filepath), os.O_RDONLY)
+        except OSError:
+            return
+
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def __write_servers_snapshot(self):
+        # The snapshot might be memory mapped by other processes
+        # (or by this one), so it is replaced and never rewritten
+        self.__write_cache(
+            CACHED_SERVERLIST_SNAPSHOT, self.__vpn_logicals.dump_snapshot()
+        )
+
+        # The new snapshot already contains the loads of the journal
+        self.remove_cache(CACHED_SERVERLIST_JOURNAL)
+        self.__cache_mtimes[CACHED_SERVERLIST_JOURNAL] = None
+
+        # The JSON cache is no longer written, it is only imported once:
+        # if kept, it would get older and older, and be imported again
+        # whenever the snapshot can't be read
+        self.remove_cache(CACHED_SERVERLIST)
+
+    def __append_servers_journal(self):
+        # Only append the loads that changed, instead of rewriting
+        # the whole snapshot
+        delta = self.__vpn_logicals.dump_load_delta()
+        if not delta:
+            return
+
+        with open(CACHED_SERVERLIST_JOURNAL, "ab+") as f:
+            f.seek(0)
+            journal = f.read()
+            length = self.__vpn_logicals.load_journal_length(journal)
+            if length == 0:
+                # Missing, or started for a previous snapshot
+                f.truncate(0)
+                f.write(self.__vpn_logicals.load_journal_header())
+            elif length < len(journal):
+                # Drop the end of an interrupted append, so that the
+                # entry is not read along with the torn one
+                f.truncate(length)
+            f.write(delta)
+            f.flush()
+            os.fsync(f.fileno())
+        self.__cache_mtimes[CACHED_SERVERLIST_JOURNAL] = self.__mtime(
+            CACHED_SERVERLIST_JOURNAL
+        )
+
+    def __load_servers(self):
+        from ..servers import ServerList, ServerListSnapshot
+
+        # Create a new server list, an existing one is reloaded in place
+        # so that it stays the list handed out (and subscribed to)
+        if self.__vpn_logicals is None:
             self.__vpn_logicals = ServerList()
+        for filepath in [CACHED_SERVERLIST_SNAPSHOT, CACHED_SERVERLIST_JOURNAL]:
+            self.__cache_mtimes[filepath] = self.__mtime(filepath)
+
+        # Try to load from file, the snapshot is only memory mapped
+        # so this does not depend on the size of the list
+        try:
+            self.__vpn_logicals.load_snapshot(
+                ServerListSnapshot.open(CACHED_SERVERLIST_SNAPSHOT)
+            )
+            try:
+                with open(CACHED_SERVERLIST_JOURNAL, "rb") as f:
+                    self.__vpn_logicals.replay_load_journal(f.read())
+            except FileNotFoundError:
+                pass
+        except Exception as e:
+            logger.info("Could not load server snapshot {}".format(e))
+
+            # ie written in an older format: drop it (and its journal),
+            # so that the next update writes a new snapshot
+            if not isinstance(e, FileNotFoundError):
+                self.remove_cache(CACHED_SERVERLIST_SNAPSHOT)
+                self.remove_cache(CACHED_SERVERLIST_JOURNAL)
 
-            # Try to load from file
+            # Import the JSON cache (ie written by an older version)
             try:
                 with open(CACHED_SERVERLIST, "r") as f:
-                    self.__vpn_logicals.json_loads(f.read())
+                    self.__vpn_logicals.json_load(f)
             except FileNotFoundError:
                 # This is not fatal,
                 # we only were not capable of loading the cache.
                 logger.info("Could not load server cache")
 
-            self._update_next_fetch_logicals()
-            self._update_next_fetch_loads()
+        self._update_next_fetch_logicals()
+        self._update_next_fetch_loads()
 
-        try:
-            self.update_servers_if_needed()
-        except: # noqa
-            pass
+    @property
+    def servers(self):
+        if self.__vpn_logicals is None:
+            self.__load_servers()
+
+        path = self.__servers_request()
+        self.__revalidate(
+            min(
+                self.__cache_timestamp("/vpn/logicals"),
+                self.__vpn_logicals.loads_update_timestamp
+            ),
+            path is not None,
+            self.update_servers_if_needed,
+            path
+        )
 
         # self.streaming
         return self.__vpn_logicals
 
+    def __client_config_request(self, force=False):
+        """Return the path to fetch to update the client config, or None."""
+        if self.__next_fetch_client_config < time.time() or force:
+            return "/vpn/clientconfig"
+
+        return None
+
+    def __commit_client_config(self, path, data):
+        if data is None:
+            # Not modified
+            self.__update_cache_validators(path, modified=False)
+            self._update_next_fetch_client_config()
+            return
+
+        self.__clientconfig.update_client_config_data(data)
+        self.__update_cache_validators(path, modified=True)
+        self._update_next_fetch_client_config()
+        try:
+            self.__write_cache(CLIENT_CONFIG, self.__clientconfig.json_dumps())
+        except Exception as e:
+            # This is not fatal, we only were not capable
+            # of storing the cache.
+            logger.info("Could not save client config cache {}".format(
+                e
+            ))
+
     @ErrorStrategyNormalCall
     def update_client_config_if_needed(self, force=False):
-        changed = False
-
         if (
             ExecutionEnvironment().settings.killswitch
             == KillswitchStatusEnum.HARD
@@ -576,61 +1074,81 @@ class APISession:
         ):
             return
 
-        if self.__next_fetch_client_config < time.time() or force:
-            # Update client config
-            logger.info("Fetching client config")
-            self.__ensure_that_alt_routing_can_be_skipped()
-            self.__clientconfig.update_client_config_data(
-                self.__proton_api.api_request(
-                    "/vpn/clientconfig"
-                )
-            )
-            changed = True
-
-        if changed:
-            self._update_next_fetch_client_config()
-            try:
-                with open(CLIENT_CONFIG, "w") as f:
-                    f.write(self.__clientconfig.json_dumps())
-            except Exception as e:
-                # This is not fatal, we only were not capable
-                # of storing the cache.
-                logger.info("Could not save client config cache {}".format(
-                    e
-                ))
+        with self.__cache_lock():
+            path = self.__client_config_request(force)
+            if path is not None:
+                # Update client config
+                logger.info("Fetching client config")
+                self.__ensure_that_alt_routing_can_be_skipped()
+                self.__commit_client_config(path, self.__api_request(path, force))
 
         return True
 
+    def __load_client_config(self):
+        from ..client_config import ClientConfig
+
+        # Create a new client config, only published once loaded as
+        # it may be reloaded while used by other threads
+        clientconfig = ClientConfig()
+        self.__cache_mtimes[CLIENT_CONFIG] = self.__mtime(CLIENT_CONFIG)
+
+        # Try to load from file
+        try:
+            with open(CLIENT_CONFIG, "r") as f:
+                clientconfig.json_loads(f.read())
+        except FileNotFoundError:
+            # This is not fatal,
+            # we only were not capable of loading the cache.
+            logger.info("Could not load client config cache")
+
+        self.__clientconfig = clientconfig
+        self._update_next_fetch_client_config()
+
     @property
     def clientconfig(self):
         if self.__clientconfig is None:
-            from ..client_config import ClientConfig
+            self.__load_client_config()
+
+        path = self.__client_config_request()
+        self.__revalidate(
+            self.__cache_timestamp("/vpn/clientconfig"),
+            path is not None,
+            self.update_client_config_if_needed,
+            path
+        )
 
-            # Create a new client config
-            self.__clientconfig = ClientConfig()
+        return self.__clientconfig
 
-            # Try to load from file
-            try:
-                with open(CLIENT_CONFIG, "r") as f:
-                    self.__clientconfig.json_loads(f.read())
-            except FileNotFoundError:
-                # This is not fatal,
-                # we only were not capable of loading the cache.
-                logger.info("Could not load client config cache")
+    def __streaming_request(self, force=False):
+        """Return the path to fetch to update streaming services, or None."""
+        if self.__next_fetch_streaming_service < time.time() or force:
+            return "/vpn/streamingservices"
 
-            self._update_next_fetch_client_config()
+        return None
 
-        try:
-            self.update_client_config_if_needed()
-        except: # noqa
-            pass
+    def __commit_streaming(self, path, data):
+        if data is None:
+            # Not modified
+            self.__update_cache_validators(path, modified=False)
+            self._update_next_fetch_streaming_services()
+            return
 
-        return self.__clientconfig
+        self.__streaming_services.update_streaming_services_data(data)
+        self.__update_cache_validators(path, modified=True)
+        self._update_next_fetch_streaming_services()
+        try:
+            self.__write_cache(
+                STREAMING_SERVICES, self.__streaming_services.json_dumps()
+            )
+        except Exception as e:
+            # This is not fatal, we only were not capable
+            # of storing the cache.
+            logger.info("Could not save streaming services cache {}".format(
+                e
+            ))
 
     @ErrorStrategyNormalCall
     def update_streaming_data_if_needed(self, force=False):
-        changed = False
-
         if (
             ExecutionEnvironment().settings.killswitch
             == KillswitchStatusEnum.HARD
@@ -638,60 +1156,215 @@ class APISession:
         ):
             return
 
-        if self.__next_fetch_streaming_service < time.time() or force:
-            # Update streaming services
-            logger.info("Fetching streaming data")
-            self.__ensure_that_alt_routing_can_be_skipped()
-            self.__streaming_services.update_streaming_services_data(
-                self.__proton_api.api_request(
-                    "/vpn/streamingservices"
-                )
-            )
-            changed = True
-
-        if changed:
-            self._update_next_fetch_streaming_services()
-            try:
-                with open(STREAMING_SERVICES, "w") as f:
-                    f.write(self.__streaming_services.json_dumps())
-            except Exception as e:
-                # This is not fatal, we only were not capable
-                # of storing the cache.
-                logger.info("Could not save streaming services cache {}".format(
-                    e
-                ))
+        with self.__cache_lock():
+            path = self.__streaming_request(force)
+            if path is not None:
+                # Update streaming services
+                logger.info("Fetching streaming data")
+                self.__ensure_that_alt_routing_can_be_skipped()
+                self.__commit_streaming(path, self.__api_request(path, force))
 
         return True
 
+    def __load_streaming(self):
+        from ..streaming import Streaming
+
+        # create new Streaming object, only published once loaded
+        streaming_services = Streaming()
+        self.__cache_mtimes[STREAMING_SERVICES] = self.__mtime(STREAMING_SERVICES)
+
+        # Try to load from file
+        try:
+            with open(STREAMING_SERVICES, "r") as f:
+                streaming_services.json_loads(f.read())
+        except FileNotFoundError:
+            # This is not fatal,
+            # we only were not capable of loading the cache.
+            logger.info("Could not load streaming cache")
+
+        self.__streaming_services = streaming_services
+        self._update_next_fetch_streaming_services()
+
     @property
     def streaming(self):
         if self.__streaming_services is None:
-            from ..streaming import Streaming
+            self.__load_streaming()
+
+        path = self.__streaming_request()
+        self.__revalidate(
+            self.__cache_timestamp("/vpn/streamingservices"),
+            path is not None,
+            self.update_streaming_data_if_needed,
+            path
+        )
 
-            # create new Streaming object
-            self.__streaming_services = Streaming()
+        self.streaming_icons
 
-            # Try to load from file
-            try:
-                with open(STREAMING_SERVICES, "r") as f:
-                    self.__streaming_services.json_loads(f.read())
-            except FileNotFoundError:
-                # This is not fatal,
-                # we only were not capable of loading the cache.
-                logger.info("Could not load streaming cache")
+        return self.__streaming_services
 
-            self._update_next_fetch_streaming_services()
+    def __streaming_icons_due(self, force=False):
+        return self.__next_fetch_streaming_icons < time.time() or force
+
+    def update_streaming_icons_if_needed(self, force=False):
+        if (
+            ExecutionEnvironment().settings.killswitch
+            == KillswitchStatusEnum.HARD
+            and not force
+        ):
+            return
+
+        with self.__cache_lock():
+            if self.__streaming_icons_due(force):
+                self.__ensure_that_alt_routing_can_be_skipped()
+                self.__update_streaming_icons(force)
 
+    def __update_streaming_icons(self, force=False):
+        if not self.__streaming_icons_due(force):
+            return
+
+        logger.info("Fetching streaming icons")
+        self.__streaming_icons.update_streaming_icons_data(self.__streaming_services)
+
+        self._update_next_fetch_streaming_icons()
         try:
-            self.update_streaming_data_if_needed()
+            self.__write_cache(
+                STREAMING_ICONS_CACHE_TIME_PATH,
+                self.__streaming_icons.json_dumps()
+            )
+        except Exception as e:
+            # This is not fatal, we only were not capable
+            # of storing the cache.
+            logger.info("Could not save streaming services cache {}".format(
+                e
+            ))
+
+    def __revalidate(self, timestamp, due, update, path=None):
+        """Make sure a cache can be used, refreshing it if due.
+
+        Stale data is returned as is while being refreshed in the
+        background. Only when there is no data, or it is older than
+        CACHE_MAX_STALENESS, the caller waits for update(), unless the
+        API asked to hold back requests to path.
+        """
+        if not due:
+            return
+
+        if path is not None and self.__backoff.retry_in(path):
+            # The cache will be refreshed once path can be requested again
+            return
+
+        if (
+            time.time() - timestamp < self.CACHE_MAX_STALENESS
+            and self.__refresh_in_background()
+        ):
+            return
+
+        try:
+            update()
         except: # noqa
             pass
 
-        self.streaming_icons
+    def refresh_in_background(self):
+        """Refresh the due caches without waiting for it.
 
-        return self.__streaming_services
+        To be used from an event loop, instead of refresh_all_if_needed().
+
+        Returns:
+            bool: False if background refreshes are disabled, in which
+                case nothing is refreshed
+        """
+        return self.__refresh_in_background()
+
+    def __refresh_in_background(self):
+        """Refresh the due caches in a background thread.
+
+        Returns:
+            bool: False if background refreshes are disabled
+        """
+        if not self.BACKGROUND_REFRESH:
+            return False
 
-    def update_streaming_icons_if_needed(self, force=False):
+        if (
+            ExecutionEnvironment().settings.killswitch
+            == KillswitchStatusEnum.HARD
+        ):
+            return True
+
+        with self.__background_refresh_lock:
+            if (
+                self.__background_refresh is not None
+                and self.__background_refresh.is_alive()
+            ):
+                return True
+
+            self.__ensure_that_alt_routing_can_be_skipped()
+            self.__background_refresh = threading.Thread(
+                target=self.__background_refresh_target,
+                name="APISessionRefresh",
+                daemon=True
+            )
+            self.__background_refresh.start()
+
+        return True
+
+    def __background_refresh_target(self):
+        try:
+            self.__refresh_all_in_background()
+        except: # noqa
+            # This is not fatal, the caches will be refreshed next time
+            logger.info("Background refresh failed")
+
+    def __schedule_refresh(self, delay):
+        """Refresh the due caches in delay seconds, in a background thread.
+
+        Only the earliest scheduled refresh is kept: it schedules the
+        next one if some requests are still held back.
+        """
+        if delay is None or not self.BACKGROUND_REFRESH:
+            return
+
+        refresh_at = time.time() + delay
+        with self.__background_refresh_lock:
+            if self.__scheduled_refresh is not None:
+                if self.__scheduled_refresh_at <= refresh_at:
+                    return
+                self.__scheduled_refresh.cancel()
+
+            logger.info("Scheduling cache refresh in {:.0f} seconds".format(
+                delay
+            ))
+            self.__scheduled_refresh = threading.Timer(
+                delay, self.__scheduled_refresh_target
+            )
+            self.__scheduled_refresh.name = "APISessionScheduledRefresh"
+            self.__scheduled_refresh.daemon = True
+            self.__scheduled_refresh_at = refresh_at
+            self.__scheduled_refresh.start()
+
+    def __scheduled_refresh_target(self):
+        with self.__background_refresh_lock:
+            self.__scheduled_refresh = None
+            self.__scheduled_refresh_at = None
+
+        if (
+            ExecutionEnvironment().settings.killswitch
+            == KillswitchStatusEnum.HARD
+        ):
+            return
+
+        self.__background_refresh_target()
+
+    @ErrorStrategyNormalCall
+    def refresh_all_if_needed(self, force=False):
+        """Refresh every cache that is due (or all of them, with force).
+
+        The API requests are made concurrently, so that the refresh takes
+        about as long as the slowest of them, instead of their sum. The
+        responses are only applied once all the requests completed, in
+        this thread, so that callers never see a partially updated cache.
+        A failed request does not prevent applying the others, its error
+        is only raised if all of them failed.
+        """
         if (
             ExecutionEnvironment().settings.killswitch
             == KillswitchStatusEnum.HARD
@@ -699,26 +1372,102 @@ class APISession:
         ):
             return
 
-        if self.__next_fetch_streaming_icons < time.time() or force:
-            logger.info("Fetching streaming icons")
+        with self.__cache_lock():
+            return self.__refresh_all(force)
+
+    @ErrorStrategyNormalCall
+    def __refresh_all_in_background(self):
+        with self.__cache_lock():
+            # Alternative routing was checked by the caller, as the
+            # connection backend is not meant to be used from other threads
+            return self.__refresh_all(check_alternative_routing=False)
+
+    def __refresh_all(self, force=False, check_alternative_routing=True):
+        import concurrent.futures
+
+        generation = self.__cache_generation
+        self.__ensure_caches_loaded()
+        requests = [
+            (path, commit)
+            for path, commit in [
+                (self.__servers_request(force), self.__commit_servers),
+                (
+                    self.__client_config_request(force),
+                    self.__commit_client_config
+                ),
+                (self.__streaming_request(force), self.__commit_streaming),
+            ]
+            if path is not None
+        ]
+        # Icons are downloaded for the streaming services, so they have
+        # to wait for them if they are being refreshed
+        streaming_due = any(
+            commit == self.__commit_streaming for _, commit in requests
+        )
+        if not requests and not self.__streaming_icons_due(force):
+            return True
+
+        if check_alternative_routing:
             self.__ensure_that_alt_routing_can_be_skipped()
-            self.__streaming_icons.update_streaming_icons_data(self.__streaming_services)
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(requests) + 1
+        ) as executor:
+            futures = []
+            for path, commit in requests:
+                logger.info("Fetching {}".format(path))
+                futures.append((
+                    executor.submit(self.__api_request, path, force),
+                    path, commit
+                ))
+            if not streaming_due:
+                executor.submit(self.__update_streaming_icons, force)
 
-            self._update_next_fetch_streaming_icons()
+        if generation != self.__cache_generation:
+            # Logged out meanwhile, the responses are the previous user's
+            logger.info("Dropping responses fetched before logout")
+            return True
+
+        # ProtonVPNException is not an Exception
+        errors = []
+        for future, path, commit in futures:
             try:
-                with open(STREAMING_ICONS_CACHE_TIME_PATH, "w") as f:
-                    f.write(self.__streaming_icons.json_dumps())
-            except Exception as e:
-                # This is not fatal, we only were not capable
-                # of storing the cache.
-                logger.info("Could not save streaming services cache {}".format(
-                    e
-                ))
+                data = future.result()
+            except (Exception, ProtonVPNException) as e:
+                logger.info("Could not fetch {}: {}".format(path, e))
+                errors.append(e)
+                continue
+
+            commit(path, data)
+            if commit == self.__commit_servers:
+                try:
+                    self.__update_loads_if_not_modified(path, data)
+                except (Exception, ProtonVPNException) as e:
+                    # The logicals are up to date, the loads will be
+                    # fetched once due again
+                    logger.info("Could not fetch /vpn/loads: {}".format(e))
+
+        if streaming_due:
+            self.__update_streaming_icons(force)
+
+        if futures and len(errors) == len(futures):
+            raise errors[0]
+
+        return True
+
+    def __ensure_caches_loaded(self):
+        if self.__vpn_logicals is None:
+            self.__load_servers()
+        if self.__clientconfig is None:
+            self.__load_client_config()
+        if self.__streaming_services is None:
+            self.__load_streaming()
+        if self.__streaming_icons is None:
+            self.__load_streaming_icons()
 
     @ErrorStrategyNormalCall
     def get_location_data(self):
         self.__ensure_that_alt_routing_can_be_skipped()
-        response = self.__proton_api.api_request("/vpn/location")
+        response = self.__request("/vpn/location")
         from ..location import CurrentLocation
         return CurrentLocation(response)
 
@@ -764,27 +1513,36 @@ class APISession:
     def captcha_url(self):
         return self.__proton_api.captcha_url
 
+    def __load_streaming_icons(self):
+        from ..streaming import StreamingIcons
+
+        # create new StreamingIcon object, only published once loaded
+        streaming_icons = StreamingIcons()
+        self.__cache_mtimes[STREAMING_ICONS_CACHE_TIME_PATH] = self.__mtime(
+            STREAMING_ICONS_CACHE_TIME_PATH
+        )
+        try:
+            with open(STREAMING_ICONS_CACHE_TIME_PATH, "r") as f:
+                streaming_icons.json_loads(f.read())
+        except FileNotFoundError:
+            # This is not fatal,
+            # we only were not capable of loading the cache.
+            logger.info("Could not load streaming time cache")
+
+        self.__streaming_icons = streaming_icons
+        self._update_next_fetch_streaming_icons()
+
     @property
     def streaming_icons(self):
         if self.__streaming_icons is None:
-            from ..streaming import StreamingIcons
+            self.__load_streaming_icons()
 
-            # create new StreamingIcon object
-            self.__streaming_icons = StreamingIcons()
-            try:
-                with open(STREAMING_ICONS_CACHE_TIME_PATH, "r") as f:
-                    self.__streaming_icons.json_loads(f.read())
-            except FileNotFoundError:
-                # This is not fatal,
-                # we only were not capable of loading the cache.
-                logger.info("Could not load streaming time cache")
-
-            self._update_next_fetch_streaming_icons()
-
-        try:
-            self.update_streaming_icons_if_needed()
-        except: # noqa
-            pass
+        # Missing icons are only not displayed, so they are never waited for
+        self.__revalidate(
+            time.time(),
+            self.__streaming_icons_due(),
+            self.update_streaming_icons_if_needed
+        )
 
         return self.__streaming_icons
 
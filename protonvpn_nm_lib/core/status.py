@@ -49,8 +49,8 @@ class Status:
         except KeyError:
             exit_server_ip = None
 
-        server = self.server_list.filter(
-            lambda server: server.name.lower() == servername.lower()
+        server = self.server_list.where(
+            name=servername
         ).get_fastest_server()
 
         self.killswitch_obj.update_connection_status()
@@ -59,6 +59,7 @@ class LastConnectionMetadataEnum(Enum):
     SERVER = ConnectionMetadataEnum.SERVER.value
     PROTOCOL = ConnectionMetadataEnum.PROTOCOL.value
     SERVER_IP = "last_connect_ip"
+    FAILED_SERVER_IPS = "failed_server_ips"
     DISPLAY_SERVER_IP = ConnectionMetadataEnum.DISPLAY_SERVER_IP.value
 
 
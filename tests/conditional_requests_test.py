@@ -0,0 +1,234 @@
+import http.server
+import json
+import threading
+
+import pytest
+
+requests = pytest.importorskip("requests")
+try:
+    from proton.exceptions import ProtonAPIError
+except ImportError:
+    pytest.skip("proton-client is not available", allow_module_level=True)
+
+from protonvpn_nm_lib.core.environment import ExecutionEnvironment # noqa
+from protonvpn_nm_lib.core.session import session as session_module # noqa
+from protonvpn_nm_lib.enums import (KillswitchStatusEnum, # noqa
+                                    UserSettingStatusEnum)
+from protonvpn_nm_lib.exceptions import API429Error # noqa
+
+CLIENT_CONFIG = {
+    "Code": 1000,
+    "OpenVPNConfig": {"DefaultPorts": {"UDP": [1194], "TCP": [443]}},
+    "FeatureFlags": {},
+}
+ETAG = '"client-config-1"'
+
+
+class StandInAPI(http.server.BaseHTTPRequestHandler):
+    """Answers /vpn/clientconfig with an ETag, and 304 when it matches."""
+    requests = []
+
+    def do_GET(self):
+        if_none_match = self.headers.get("If-None-Match")
+        self.requests.append((self.path, if_none_match))
+        if if_none_match == ETAG:
+            self.send_response(304)
+            self.send_header("ETag", ETAG)
+            self.end_headers()
+            return
+
+        body = json.dumps(CLIENT_CONFIG).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", ETAG)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubSession:
+    """Like proton.api.Session, without authentication, against url."""
+    url = None
+
+    def __init__(self, *args, **kwargs):
+        self.s = requests.Session()
+        self.enable_alternative_routing = False
+
+    def api_request(
+        self, endpoint, jsondata=None, additional_headers=None, method=None
+    ):
+        ret = self.s.get(
+            self.url + endpoint, headers=additional_headers, timeout=5
+        )
+        try:
+            ret = ret.json()
+        except json.decoder.JSONDecodeError:
+            raise ProtonAPIError(
+                {
+                    "Code": ret.status_code,
+                    "Error": ret.reason,
+                    "Headers": ret.headers
+                }
+            )
+
+        if ret["Code"] != 1000:
+            raise ProtonAPIError(ret)
+
+        return ret
+
+
+class Settings:
+    killswitch = KillswitchStatusEnum.DISABLED
+    alternative_routing = UserSettingStatusEnum.DISABLED
+
+
+@pytest.fixture
+def api_session(tmp_path, monkeypatch):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StandInAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    StandInAPI.requests = []
+    StubSession.url = "http://127.0.0.1:{}".format(server.server_address[1])
+
+    import proton.api
+    monkeypatch.setattr(proton.api, "Session", StubSession)
+    for name in [
+        "CLIENT_CONFIG", "CACHE_VALIDATORS", "CACHE_LOCK", "CACHED_SERVERLIST",
+        "CACHED_SERVERLIST_JOURNAL", "CACHED_SERVERLIST_SNAPSHOT",
+        "STREAMING_SERVICES", "STREAMING_ICONS_CACHE_TIME_PATH"
+    ]:
+        monkeypatch.setattr(session_module, name, str(tmp_path / name))
+    monkeypatch.setattr(ExecutionEnvironment, "user_agent", "StandInAPI")
+    env = ExecutionEnvironment()
+    monkeypatch.setattr(env, "_ExecutionEnvironment__settings", Settings())
+    monkeypatch.setattr(env, "_ExecutionEnvironment__keyring", {})
+    monkeypatch.setattr(
+        session_module.APISession,
+        "_APISession__ensure_that_alt_routing_can_be_skipped",
+        lambda self: None
+    )
+
+    api_session = session_module.APISession()
+    # Refresh synchronously, and whenever the client config is accessed
+    api_session.BACKGROUND_REFRESH = False
+    api_session.CLIENT_CONFIG_TIME_EXPIRE = 0
+    yield api_session
+    scheduled_refresh = api_session._APISession__scheduled_refresh
+    if scheduled_refresh is not None:
+        scheduled_refresh.cancel()
+    server.shutdown()
+    server.server_close()
+
+
+def test_not_modified_keeps_content_and_revalidates(api_session):
+    client_config_timestamp = api_session.clientconfig.client_config_timestamp
+    with open(session_module.CLIENT_CONFIG) as f:
+        cached_client_config = f.read()
+    with open(session_module.CACHE_VALIDATORS) as f:
+        validators = json.load(f)["/vpn/clientconfig"]
+    assert validators["ETag"] == ETAG
+
+    clientconfig = api_session.clientconfig
+    assert StandInAPI.requests == [
+        ("/vpn/clientconfig", None), ("/vpn/clientconfig", ETAG)
+    ]
+    # The content is the same...
+    assert clientconfig.client_config_timestamp == client_config_timestamp
+    assert clientconfig.default_udp_ports == [1194]
+    with open(session_module.CLIENT_CONFIG) as f:
+        assert f.read() == cached_client_config
+    # ...but it is now known to be up to date
+    with open(session_module.CACHE_VALIDATORS) as f:
+        revalidated = json.load(f)["/vpn/clientconfig"]
+    assert revalidated["ValidatedTimestamp"] > validators["ValidatedTimestamp"]
+
+
+def test_forced_request_is_not_conditional(api_session):
+    api_session.clientconfig
+    api_session.update_client_config_if_needed(force=True)
+    assert StandInAPI.requests == [
+        ("/vpn/clientconfig", None), ("/vpn/clientconfig", None)
+    ]
+
+
+def hold_back(api_session, path):
+    api_session._APISession__backoff.failure(
+        path,
+        ProtonAPIError(
+            {
+                "Code": 429,
+                "Error": "Too Many Requests",
+                "Headers": {"Retry-After": "60"}
+            }
+        )
+    )
+
+
+def make_due(api_session, *names):
+    """Only the given caches (by their next fetch attribute) are due."""
+    # Load the caches first, it computes when they are due
+    api_session._APISession__ensure_caches_loaded()
+    for name in [
+        "logicals", "load", "client_config", "streaming_service",
+        "streaming_icons"
+    ]:
+        setattr(
+            api_session,
+            "_APISession__next_fetch_" + name,
+            0 if name in names else float("inf")
+        )
+
+
+def test_held_back_endpoint_does_not_prevent_refreshing_others(api_session):
+    api_session.clientconfig
+    with open(session_module.CACHE_VALIDATORS) as f:
+        validators = json.load(f)["/vpn/clientconfig"]
+    hold_back(api_session, "/vpn/streamingservices")
+    make_due(api_session, "client_config", "streaming_service")
+
+    api_session.refresh_all_if_needed()
+    # The held back endpoint is not requested...
+    assert StandInAPI.requests == [
+        ("/vpn/clientconfig", None), ("/vpn/clientconfig", ETAG)
+    ]
+    # ...and the other one is still revalidated
+    with open(session_module.CACHE_VALIDATORS) as f:
+        revalidated = json.load(f)["/vpn/clientconfig"]
+    assert revalidated["ValidatedTimestamp"] > validators["ValidatedTimestamp"]
+
+
+def test_error_is_raised_when_every_endpoint_failed(api_session):
+    api_session.clientconfig
+    hold_back(api_session, "/vpn/clientconfig")
+    hold_back(api_session, "/vpn/streamingservices")
+    make_due(api_session, "client_config", "streaming_service")
+
+    with pytest.raises(API429Error):
+        api_session.refresh_all_if_needed()
+    assert StandInAPI.requests == [("/vpn/clientconfig", None)]
+
+
+def test_held_back_endpoint_does_not_hold_back_others(api_session):
+    # Schedule refreshes, but still wait for the due caches
+    api_session.BACKGROUND_REFRESH = True
+    api_session.CACHE_MAX_STALENESS = 0
+    api_session.clientconfig
+    hold_back(api_session, "/vpn/streamingservices")
+    make_due(api_session, "client_config", "streaming_service")
+    # Fails right away, and schedules a refresh for when it is let through
+    with pytest.raises(API429Error):
+        api_session.update_streaming_data_if_needed()
+    assert api_session._APISession__scheduled_refresh is not None
+
+    # The client config is still revalidated when accessed...
+    api_session.clientconfig
+    assert StandInAPI.requests == [
+        ("/vpn/clientconfig", None), ("/vpn/clientconfig", ETAG)
+    ]
+
+    # ...until it is held back too, and the cached one is used
+    hold_back(api_session, "/vpn/clientconfig")
+    api_session.clientconfig
+    assert len(StandInAPI.requests) == 2
@@ -0,0 +1,178 @@
+import pytest
+
+pytest.importorskip("xdg")
+
+from protonvpn_nm_lib.core.servers import ServerList, ServerListSnapshot # noqa
+from protonvpn_nm_lib.core.servers.journal import CHANGE # noqa
+
+
+def logical(idx, name, tier, exit_ip):
+    return {
+        "ID": "id{}".format(idx),
+        "Name": name,
+        "EntryCountry": name[:2],
+        "ExitCountry": name[:2],
+        "Domain": "node-{}.protonvpn.net".format(idx),
+        "Tier": tier,
+        "Features": 0,
+        "Region": None,
+        "City": None,
+        "Score": float(idx),
+        "HostCountry": None,
+        "Location": {"Lat": 0.0, "Long": 0.0},
+        "Status": 1,
+        "Load": idx,
+        "Servers": [
+            {
+                "ID": "p{}".format(idx),
+                "EntryIP": "10.0.0.{}".format(idx),
+                "ExitIP": exit_ip,
+                "Domain": "node-{}.protonvpn.net".format(idx),
+                "Status": 1,
+                "Label": "",
+                "Generation": 0,
+                "ServicesDown": 0,
+                "ServicesDownReason": None,
+            }
+        ],
+    }
+
+
+LOGICALS = [
+    logical(1, "CH#1", 2, "11.0.0.1"),
+    logical(2, "SE#1", 0, "11.0.0.2"),
+    logical(3, "CH#2", 1, "11.0.0.3"),
+    logical(4, "SE#2", 0, "11.0.0.4"),
+]
+
+
+@pytest.fixture
+def server_list():
+    server_list = ServerList()
+    server_list.update_logical_data(
+        {"Code": 1000, "LogicalServers": LOGICALS}
+    )
+    return server_list
+
+
+@pytest.fixture
+def snapshot_path(server_list, tmp_path):
+    path = tmp_path / "serverlist.snapshot"
+    path.write_bytes(server_list.dump_snapshot())
+    return str(path)
+
+
+def test_snapshot_lookups(snapshot_path):
+    snapshot = ServerListSnapshot.open(snapshot_path)
+    assert snapshot.row_count == len(LOGICALS)
+
+    row = snapshot.row_by_id("id3")
+    assert snapshot.logical(row)["Name"] == "CH#2"
+    assert snapshot.row_by_id("id5") is None
+    assert snapshot.ids[snapshot.row_by_name("se#1")] == "id2"
+    assert snapshot.row_by_name("SE#3") is None
+    assert snapshot.names_with_prefix("CH#") == ["ch#1", "ch#2"]
+    assert snapshot.names_with_prefix("US#") == []
+
+    row, domain = snapshot.exit_ip("11.0.0.4")
+    assert snapshot.ids[row] == "id4"
+    assert domain == "node-4.protonvpn.net"
+    assert snapshot.exit_ip("11.0.0.5") is None
+
+
+def test_snapshot_tier_partitions(snapshot_path):
+    snapshot = ServerListSnapshot.open(snapshot_path)
+    partitions = snapshot.tier_partitions()
+    assert sorted(partitions) == [0, 1, 2]
+    assert sorted(
+        snapshot.ids[row] for row in partitions[0]
+    ) == ["id2", "id4"]
+    assert [snapshot.ids[row] for row in partitions[1]] == ["id3"]
+    assert [snapshot.ids[row] for row in partitions[2]] == ["id1"]
+
+
+def test_server_list_from_snapshot(server_list, snapshot_path):
+    loaded = ServerList()
+    loaded.load_snapshot(ServerListSnapshot.open(snapshot_path))
+    assert [server.name for server in loaded] == \
+        [server.name for server in server_list]
+    assert loaded.logicals_update_timestamp \
+        == server_list.logicals_update_timestamp
+
+    server = loaded.get_server_by_name("ch#2")
+    assert server.id == "id3"
+    assert server.load == 3
+    assert loaded.get_servernames_with_prefix("se#") == ["SE#1", "SE#2"]
+
+    physical_server = server.get_physical_server()
+    physical_server.domain = None
+    loaded.match_server_domain(physical_server)
+    assert physical_server.domain == "node-3.protonvpn.net"
+
+
+@pytest.mark.parametrize("offset, value", [(0, b"XXXX"), (4, b"\xff\xff")])
+def test_unsupported_snapshot(server_list, offset, value):
+    snapshot = bytearray(server_list.dump_snapshot())
+    snapshot[offset:offset + len(value)] = value
+    with pytest.raises(ValueError):
+        ServerListSnapshot(bytes(snapshot))
+    with pytest.raises(ValueError):
+        ServerList().load_snapshot(bytes(snapshot))
+
+
+def loads_update(*changes):
+    return {
+        "Code": 1000,
+        "LogicalServers": [
+            {"ID": logical_id, "Load": load, "Score": 1.0, "Status": 1}
+            for logical_id, load in changes
+        ]
+    }
+
+
+def test_journal_replay(server_list, snapshot_path):
+    journal = server_list.load_journal_header()
+    server_list.update_load_data(loads_update(("id1", 50)))
+    journal += server_list.dump_load_delta()
+    server_list.update_load_data(loads_update(("id1", 60), ("id2", 70)))
+    journal += server_list.dump_load_delta()
+    assert server_list.load_journal_length(journal) == len(journal)
+
+    loaded = ServerList()
+    loaded.load_snapshot(ServerListSnapshot.open(snapshot_path))
+    loaded.replay_load_journal(journal)
+    assert loaded.get_server_by_name("CH#1").load == 60
+    assert loaded.get_server_by_name("SE#1").load == 70
+    assert loaded.get_server_by_name("CH#2").load == 3
+    assert loaded.loads_update_timestamp \
+        == server_list.loads_update_timestamp
+
+
+def test_journal_replay_stops_at_torn_entry(server_list, snapshot_path):
+    journal = server_list.load_journal_header()
+    server_list.update_load_data(loads_update(("id1", 50)))
+    journal += server_list.dump_load_delta()
+    valid_length = len(journal)
+    server_list.update_load_data(loads_update(("id1", 60), ("id2", 70)))
+    # Interrupted while writing the second change of the last entry
+    journal += server_list.dump_load_delta()[:-CHANGE.size // 2]
+    assert server_list.load_journal_length(journal) == valid_length
+
+    loaded = ServerList()
+    loaded.load_snapshot(ServerListSnapshot.open(snapshot_path))
+    loaded.replay_load_journal(journal)
+    assert loaded.get_server_by_name("CH#1").load == 50
+    assert loaded.get_server_by_name("SE#1").load == 2
+
+
+def test_journal_of_another_snapshot_is_ignored(server_list, snapshot_path):
+    journal = server_list.load_journal_header()
+    server_list.update_load_data(loads_update(("id1", 50)))
+    journal += server_list.dump_load_delta()
+
+    server_list.update_logical_data(
+        {"Code": 1000, "LogicalServers": LOGICALS}
+    )
+    assert server_list.load_journal_length(journal) == 0
+    server_list.replay_load_journal(journal)
+    assert server_list.get_server_by_name("CH#1").load == 1